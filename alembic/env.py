@@ -23,6 +23,13 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = SQLModel.metadata
 
+# Created by migrations only and not declared on the models (the generated descr_tsv column and its
+# GIN index are Postgres-only), so autogenerate must not propose dropping them
+MIGRATION_ONLY = {("column", "descr_tsv"), ("index", "ix_bribe_descr_tsv")}
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (reflected and compare_to is None and (type_, name) in MIGRATION_ONLY)
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -44,6 +51,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -69,7 +77,7 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_object=include_object
         )
 
         with context.begin_transaction():
@@ -0,0 +1,46 @@
+"""add bribestat rollup table for the state / department / month statistics
+
+Revision ID: 1f6d3b8e5a27
+Revises: 9c4f2e7a1b36
+Create Date: 2026-10-18 15:41:22.640915
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1f6d3b8e5a27'
+down_revision: Union[str, None] = '9c4f2e7a1b36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('bribestat',
+        sa.Column('state_ut', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('district', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('dept', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('month', sqlmodel.sql.sqltypes.AutoString(length=7), nullable=False),
+        sa.Column('report_count', sa.Integer(), nullable=False),
+        sa.Column('amount_total', sa.BigInteger(), server_default='0', nullable=False),
+        sa.Column('amount_max', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('state_ut', 'district', 'dept', 'month')
+    )
+    # fill it from the existing reports, same query as `python -m package.rollups rebuild`
+    op.execute("""
+        INSERT INTO bribestat (state_ut, district, dept, month, report_count, amount_total, amount_max)
+        SELECT state_ut, district, dept, coalesce(to_char(doi, 'YYYY-MM'), 'unknown'),
+               count(*), sum(bribe_amt), max(bribe_amt)
+        FROM bribe
+        GROUP BY 1, 2, 3, 4
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('bribestat')
@@ -0,0 +1,29 @@
+"""adding evidence_status column in bribe table for background evidence uploads
+
+Revision ID: 3b4707b4760f
+Revises: d2c37ef9cfb3
+Create Date: 2026-10-18 11:40:05.318842
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b4707b4760f'
+down_revision: Union[str, None] = 'd2c37ef9cfb3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('bribe', sa.Column('evidence_status', sqlmodel.sql.sqltypes.AutoString(length=10), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('bribe', 'evidence_status')
@@ -0,0 +1,42 @@
+"""add indexes on bribe for the per-user track query and the filtered listing
+
+Revision ID: 5e81c0a4d9b2
+Revises: 3b4707b4760f
+Create Date: 2026-10-18 14:32:10.517204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e81c0a4d9b2'
+down_revision: Union[str, None] = '3b4707b4760f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# name -> columns. The amount ordered ones end in (bribe_amt, bribe_id) so a filtered listing
+# walks the index in cursor order instead of sorting the matching rows.
+INDEXES = {
+    'ix_bribe_id_bribe_amt': ['id', 'bribe_amt'],
+    'ix_bribe_state_ut_district_bribe_amt': ['state_ut', 'district', 'bribe_amt', 'bribe_id'],
+    'ix_bribe_dept_bribe_amt': ['dept', 'bribe_amt', 'bribe_id'],
+    'ix_bribe_doi': ['doi'],
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # built concurrently so the bribe table stays writable while the indexes are created
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.create_index(name, 'bribe', columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name in reversed(INDEXES):
+            op.drop_index(name, table_name='bribe', postgresql_concurrently=True)
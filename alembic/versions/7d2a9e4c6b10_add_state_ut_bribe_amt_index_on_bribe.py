@@ -0,0 +1,33 @@
+"""add (state_ut, bribe_amt, bribe_id) index on bribe for the state-only listing filter
+
+Revision ID: 7d2a9e4c6b10
+Revises: 1f6d3b8e5a27
+Create Date: 2026-10-18 17:05:48.203611
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2a9e4c6b10'
+down_revision: Union[str, None] = '1f6d3b8e5a27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # (state_ut, district, bribe_amt, bribe_id) can't return a state's rows in amount order
+    # without a sort, this one can. Built concurrently so the bribe table stays writable.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_bribe_state_ut_bribe_amt', 'bribe', ['state_ut', 'bribe_amt', 'bribe_id'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_bribe_state_ut_bribe_amt', table_name='bribe', postgresql_concurrently=True)
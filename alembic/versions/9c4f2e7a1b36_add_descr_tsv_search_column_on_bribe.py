@@ -0,0 +1,41 @@
+"""add generated descr_tsv column with a GIN index for full-text search of reports
+
+Revision ID: 9c4f2e7a1b36
+Revises: 5e81c0a4d9b2
+Create Date: 2026-10-18 15:05:47.902316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4f2e7a1b36'
+down_revision: Union[str, None] = '5e81c0a4d9b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Official name and department weigh more than the free text description. Must stay in sync
+    # with SEARCH_CONFIG in queries.py, the query side has to parse with the same configuration.
+    # Adding a stored generated column rewrites the table once, run it in a quiet window.
+    op.execute("""
+        ALTER TABLE bribe ADD COLUMN descr_tsv tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english'::regconfig, coalesce(ofcl_name, '') || ' ' || coalesce(dept, '')), 'A') ||
+            setweight(to_tsvector('english'::regconfig, coalesce(descr, '')), 'B')
+        ) STORED
+    """)
+    with op.get_context().autocommit_block():
+        op.create_index('ix_bribe_descr_tsv', 'bribe', ['descr_tsv'], unique=False,
+                        postgresql_using='gin', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_bribe_descr_tsv', table_name='bribe', postgresql_concurrently=True)
+    op.drop_column('bribe', 'descr_tsv')
@@ -0,0 +1,32 @@
+"""add (bribe_amt, bribe_id) index for keyset pagination of the leaderboard
+
+Revision ID: d2c37ef9cfb3
+Revises: a8db39131e93
+Create Date: 2026-10-18 09:12:41.204117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2c37ef9cfb3'
+down_revision: Union[str, None] = 'a8db39131e93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # built concurrently so the bribe table stays writable while the index is created
+    with op.get_context().autocommit_block():
+        op.create_index('ix_bribe_bribe_amt_bribe_id', 'bribe', ['bribe_amt', 'bribe_id'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_bribe_bribe_amt_bribe_id', table_name='bribe', postgresql_concurrently=True)
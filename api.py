@@ -0,0 +1,108 @@
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import ORJSONResponse
+from .db import async_session
+from .pagination import InvalidCursor, encode_cursor, decode_cursor
+from .queries import LISTING_COLUMNS, TRACK_COLUMNS, ListingFilters, listing_page, track_rows
+from urllib.parse import urlencode
+import brotli
+import gzip
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Smaller bodies are sent uncompressed, the encoding overhead isn't worth it
+API_COMPRESS_MIN_BYTES = int(os.environ.get("api_compress_min_bytes", "1024"))
+
+LISTING_FIELDS = [column.key for column in LISTING_COLUMNS]
+TRACK_FIELDS = [column.key for column in TRACK_COLUMNS]
+
+# Versioned JSON API. Rows are sent as {"columns": [...], "rows": [[...], ...]} straight from the
+# selected column tuples, serialized by orjson and compressed with brotli or gzip when the client
+# accepts it. Negotiated here rather than by GZipMiddleware, which only does gzip and would also
+# compress the HTML pages.
+router = APIRouter(prefix="/api/v1")
+
+# Encodings the API can send, preferred in this order when the client rates them equally
+ENCODINGS = ("br", "gzip")
+
+def _qualities(accept_encoding: str) -> dict[str, float]:
+    qualities = {}
+    for item in accept_encoding.lower().split(","):
+        name, *params = item.split(";")
+        name = name.strip()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    return qualities
+
+# Picks the encoding for Accept-Encoding as RFC 9110 reads it: "*" rates every encoding that isn't
+# listed, q=0 refuses one, and an unlisted identity is acceptable unless "*;q=0" refuses it.
+# Returns the encoding ("identity" for none) and whether the client refused identity.
+def _negotiate_encoding(accept_encoding: str) -> tuple[str, bool]:
+    qualities = _qualities(accept_encoding)
+    wildcard = qualities.get("*")
+    identity_refused = qualities.get("identity", wildcard if wildcard is not None else 1.0) <= 0
+    best, best_quality = "identity", 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, wildcard or 0.0)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best, identity_refused
+
+def json_response(request: Request, content, status_code: int = 200) -> ORJSONResponse:
+    response = ORJSONResponse(content, status_code=status_code)
+    response.headers["Vary"] = "Accept-Encoding"
+    encoding, identity_refused = _negotiate_encoding(request.headers.get("accept-encoding", ""))
+    # small bodies go uncompressed unless the client won't take that
+    if encoding == "identity" or (len(response.body) < API_COMPRESS_MIN_BYTES and not identity_refused):
+        return response
+    if encoding == "br":
+        response.body = brotli.compress(response.body, quality=5)
+    else:
+        response.body = gzip.compress(response.body, compresslevel=6)
+    response.headers["Content-Encoding"] = encoding
+    response.headers["Content-Length"] = str(len(response.body))
+    return response
+
+# Leaderboard order (amount, then bribe_id, descending) with the /reports filters and keyset cursor
+@router.get("/reports")
+async def list_reports(request: Request, filters: ListingFilters = Depends(), after: str | None = None):
+    after_key = None
+    if after:
+        try:
+            after_key = decode_cursor(after)
+        except InvalidCursor:
+            logger.warning("Invalid API listing cursor received: %s", after)
+            return json_response(request, {"error": "Invalid cursor."}, status_code=400)
+
+    async with async_session() as session:
+        rows, has_more = await listing_page(session, after=after_key, filters=filters)
+
+    next_url = None
+    if has_more:
+        cursor = encode_cursor(rows[-1].bribe_amt, rows[-1].bribe_id)
+        next_url = "/api/v1/reports?" + urlencode({**filters.query_params(), "after": cursor})
+    return json_response(request, {"columns": LISTING_FIELDS, "rows": [tuple(row) for row in rows], "next": next_url})
+
+# Same lookup as the track form: all reports of a user, one report by id, or both
+@router.get("/track")
+async def track(request: Request, username: str | None = None, reporting_id: str | None = None):
+    username = username.strip() if username else None
+    reporting_id = reporting_id.strip() if reporting_id else None
+    if not username and not reporting_id:
+        return json_response(request, {"error": "Provide a username or a reporting_id."}, status_code=400)
+
+    async with async_session() as session:
+        rows = await track_rows(session, username=username, reporting_id=reporting_id)
+    if not rows:
+        return json_response(request, {"error": "No reports found for the provided information."}, status_code=404)
+    return json_response(request, {"columns": TRACK_FIELDS, "rows": [tuple(row) for row in rows]})
@@ -0,0 +1,93 @@
+from collections import OrderedDict
+import asyncio
+import jwt
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Local verification of Supabase access tokens. HS256 projects set supabase_jwt_secret, projects on
+# asymmetric signing keys set supabase_jwks_url (…/auth/v1/.well-known/jwks.json). With neither set,
+# get_current_user keeps asking the auth server for every request.
+JWT_SECRET = os.environ.get("supabase_jwt_secret")
+JWKS_URL = os.environ.get("supabase_jwks_url")
+JWT_AUDIENCE = os.environ.get("supabase_jwt_audience", "authenticated")
+TOKEN_CACHE_SIZE = int(os.environ.get("auth_token_cache_size", "1024"))
+
+# asymmetric algorithms need the cryptography package, which PyJWT only imports when they are used
+JWKS_ALGORITHMS = ["RS256", "ES256", "EdDSA"]
+
+jwks_client = jwt.PyJWKClient(JWKS_URL, cache_keys=True) if JWKS_URL else None
+
+def local_verification_enabled() -> bool:
+    return bool(JWT_SECRET or jwks_client)
+
+# The token can't be checked here (not that it is invalid), the caller should ask the auth server
+class VerificationUnavailable(jwt.PyJWTError):
+    pass
+
+# The parts of the Supabase user the app reads, built from the verified token claims
+class VerifiedUser:
+    __slots__ = ("id", "email", "role", "user_metadata", "app_metadata")
+
+    def __init__(self, claims: dict):
+        self.id = claims["sub"]
+        self.email = claims.get("email")
+        self.role = claims.get("role")
+        self.user_metadata = claims.get("user_metadata") or {}
+        self.app_metadata = claims.get("app_metadata") or {}
+
+    def __repr__(self):
+        return f"VerifiedUser(id={self.id!r}, username={self.user_metadata.get('username')!r})"
+
+# Bounded LRU of tokens that already passed verification, token -> (user, exp)
+class TokenCache:
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[VerifiedUser, float]] = OrderedDict()
+
+    def get(self, token: str) -> VerifiedUser | None:
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        user, exp = entry
+        if exp <= time.time():
+            del self._entries[token]
+            return None
+        self._entries.move_to_end(token)
+        return user
+
+    def put(self, token: str, user: VerifiedUser, exp: float) -> None:
+        self._entries[token] = (user, exp)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def discard(self, token: str) -> None:
+        self._entries.pop(token, None)
+
+token_cache = TokenCache()
+
+# Raises jwt.ExpiredSignatureError for expired tokens (the caller should refresh),
+# jwt.InvalidTokenError for anything else that fails verification and other jwt.PyJWTErrors
+# (VerificationUnavailable, JWKS fetch errors) when the token can't be verified locally.
+async def verify_access_token(access_token: str) -> VerifiedUser:
+    user = token_cache.get(access_token)
+    if user is not None:
+        return user
+
+    if jwks_client is not None and jwt.get_unverified_header(access_token).get("alg") != "HS256":
+        # key lookups are cached by PyJWKClient, only a cache miss fetches the JWKS over the network
+        signing_key = await asyncio.to_thread(jwks_client.get_signing_key_from_jwt, access_token)
+        key, algorithms = signing_key.key, JWKS_ALGORITHMS
+    elif JWT_SECRET:
+        key, algorithms = JWT_SECRET, ["HS256"]
+    else:
+        raise VerificationUnavailable("No key configured to verify HS256 access tokens")
+
+    claims = jwt.decode(access_token, key, algorithms=algorithms, audience=JWT_AUDIENCE,
+                        options={"require": ["exp", "sub"]})
+    user = VerifiedUser(claims)
+    token_cache.put(access_token, user, claims["exp"])
+    return user
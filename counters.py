@@ -0,0 +1,60 @@
+from sqlmodel import select, func, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .models import Bribe
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# "exact" always counts rows, "approximate" always uses the planner estimate from pg_class,
+# "auto" counts exactly until the estimate crosses bribe_count_exact_threshold
+COUNT_MODE = os.environ.get("bribe_count_mode", "auto")
+COUNT_TTL = float(os.environ.get("bribe_count_ttl", "60"))
+COUNT_EXACT_THRESHOLD = int(os.environ.get("bribe_count_exact_threshold", "1000000"))
+
+# In-process cache of the bribe row count used by the index pagination. The value is refreshed
+# at most once per ttl seconds and bumped in place when this worker commits a new report.
+class BribeCounter:
+    def __init__(self, mode: str = COUNT_MODE, ttl: float = COUNT_TTL, exact_threshold: int = COUNT_EXACT_THRESHOLD):
+        self.mode = mode
+        self.ttl = ttl
+        self.exact_threshold = exact_threshold
+        self._value: int | None = None
+        self._expires_at = 0.0
+
+    async def get(self, session: AsyncSession) -> int:
+        now = time.monotonic()
+        if self._value is None or now >= self._expires_at:
+            self._value = await self._count(session)
+            self._expires_at = now + self.ttl
+        return self._value
+
+    def record_insert(self, n: int = 1) -> None:
+        # Other workers' inserts are picked up when the ttl runs out
+        if self._value is not None:
+            self._value += n
+
+    def invalidate(self) -> None:
+        self._value = None
+
+    async def _count(self, session: AsyncSession) -> int:
+        if self.mode != "exact":
+            estimate = await self._estimate(session)
+            if estimate is not None and (self.mode == "approximate" or estimate >= self.exact_threshold):
+                logger.debug("Using approximate bribe count: %s", estimate)
+                return estimate
+        return (await session.exec(select(func.count()).select_from(Bribe))).one()
+
+    async def _estimate(self, session: AsyncSession) -> int | None:
+        if session.get_bind().dialect.name != "postgresql":
+            return None
+        reltuples = (await session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'bribe'::regclass")
+        )).scalar()
+        # reltuples stays at -1 until the table has been vacuumed or analyzed once
+        if reltuples is None or reltuples < 0:
+            return None
+        return int(reltuples)
+
+bribe_counter = BribeCounter()
@@ -1,6 +1,138 @@
 from . import models
-from sqlmodel import create_engine
+from sqlmodel import SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+from sqlalchemy import event, exc
 import os
+import time
+from uuid import uuid4
 
 DB_URL = os.environ.get("db_url")
-engine = create_engine(DB_URL)
\ No newline at end of file
+
+# Pool settings, all overridable from the environment.
+# db_pool_mode=null opens a fresh connection per checkout, for running behind PgBouncer in
+# transaction mode where PgBouncer does the pooling and server side prepared statements break.
+POOL_MODE = os.environ.get("db_pool_mode", "queue")
+POOL_SIZE = int(os.environ.get("db_pool_size", "10"))
+POOL_MAX_OVERFLOW = int(os.environ.get("db_max_overflow", "20"))
+POOL_TIMEOUT = float(os.environ.get("db_pool_timeout", "30"))
+POOL_RECYCLE = int(os.environ.get("db_pool_recycle", "1800"))
+POOL_PRE_PING = os.environ.get("db_pool_pre_ping", "true").lower() in ("1", "true", "yes")
+
+engine = create_engine(DB_URL, pool_pre_ping=POOL_PRE_PING, pool_recycle=POOL_RECYCLE)
+
+# async drivers used by the request handlers, the sync engine above stays for create_all and scripts
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+def async_db_url(url: str):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS:
+        url = url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    return url
+
+# Checkout counters for the async pool, published through pool_status()
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.checkout_seconds_total = 0.0
+        self.checkout_seconds_max = 0.0
+
+    def record_checkout(self, seconds: float) -> None:
+        self.checkouts += 1
+        self.checkout_seconds_total += seconds
+        self.checkout_seconds_max = max(self.checkout_seconds_max, seconds)
+
+pool_stats = PoolStats()
+
+# Times how long a checkout waits for a connection (or, with NullPool, how long connecting takes)
+class _TimedCheckout:
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.timeouts += 1
+            raise
+        finally:
+            pool_stats.record_checkout(time.perf_counter() - start)
+
+class TimedQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+class TimedNullPool(_TimedCheckout, NullPool):
+    pass
+
+def async_engine_options() -> dict:
+    options = {"pool_pre_ping": POOL_PRE_PING}
+    if POOL_MODE == "null":
+        options["poolclass"] = TimedNullPool
+        # PgBouncer transaction mode hands each transaction a different server connection,
+        # so asyncpg must not cache prepared statements, and the unnamed ones it still prepares
+        # get unique names so they can't collide with another client's on a shared server connection
+        options["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    else:
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=POOL_SIZE,
+            max_overflow=POOL_MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            pool_recycle=POOL_RECYCLE,
+        )
+    return options
+
+ASYNC_DB_URL = os.environ.get("async_db_url") or async_db_url(DB_URL)
+async_engine = create_async_engine(ASYNC_DB_URL, **async_engine_options())
+
+@event.listens_for(async_engine.sync_engine.pool, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats.in_use += 1
+
+@event.listens_for(async_engine.sync_engine.pool, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    pool_stats.in_use -= 1
+
+def pool_status() -> dict:
+    pool = async_engine.sync_engine.pool
+    queued = isinstance(pool, AsyncAdaptedQueuePool)
+    return {
+        "mode": POOL_MODE,
+        "size": pool.size() if queued else 0,
+        "max_overflow": POOL_MAX_OVERFLOW if queued else 0,
+        # QueuePool counts overflow from -pool_size, it only goes positive once the pool is exhausted
+        "overflow": max(pool.overflow(), 0) if queued else 0,
+        "idle": pool.checkedin() if queued else 0,
+        "in_use": pool_stats.in_use,
+        "checkouts": pool_stats.checkouts,
+        "checkout_timeouts": pool_stats.timeouts,
+        "checkout_seconds_avg": pool_stats.checkout_seconds_total / pool_stats.checkouts if pool_stats.checkouts else 0.0,
+        "checkout_seconds_max": pool_stats.checkout_seconds_max,
+    }
+
+# Postgres SQLSTATE of a unique constraint violation
+UNIQUE_VIOLATION = "23505"
+SQLITE_UNIQUE_ERRORS = {"SQLITE_CONSTRAINT_PRIMARYKEY", "SQLITE_CONSTRAINT_UNIQUE"}
+
+# Whether an IntegrityError is a duplicate key in table, as opposed to a foreign key, NOT NULL or
+# check violation. asyncpg's original error is the cause of the adapted one, psycopg2 reports the
+# table in diag.
+def is_duplicate_key(error: exc.IntegrityError, table: str) -> bool:
+    orig = error.orig
+    if getattr(orig, "pgcode", None) == UNIQUE_VIOLATION:
+        details = orig.__cause__ if orig.__cause__ is not None else getattr(orig, "diag", None)
+        return getattr(details, "table_name", None) == table
+    if getattr(orig, "sqlite_errorname", None) in SQLITE_UNIQUE_ERRORS:
+        return f" {table}." in str(orig) # "UNIQUE constraint failed: bribe.bribe_id"
+    return False
+
+# expire_on_commit=False so committed objects can still be read without an implicit (awaited) refresh
+def async_session() -> AsyncSession:
+    return AsyncSession(async_engine, expire_on_commit=False)
@@ -0,0 +1,194 @@
+from fastapi import UploadFile
+from dataclasses import dataclass
+from supabase import AsyncClient
+from .supabase_scope import scoped_bucket
+import asyncio
+import io
+import os
+import shutil
+import tempfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How many evidence files of one report are sent to storage at the same time
+UPLOAD_CONCURRENCY = int(os.environ.get("evidence_upload_concurrency", "4"))
+# Largest accepted evidence file, checked before anything is spooled or uploaded
+MAX_EVIDENCE_BYTES = int(os.environ.get("evidence_max_bytes", str(10 * 1024 * 1024)))
+# Where background mode spools uploads for the evidence workers, defaults to the system temp dir
+SPOOL_DIR = os.environ.get("evidence_spool_dir") or None
+CHUNK_SIZE = 256 * 1024
+
+class EvidenceUploadError(Exception):
+    pass
+
+class EvidenceTooLarge(EvidenceUploadError):
+    pass
+
+def bucket_for(content_type: str | None) -> str | None:
+    if content_type and content_type.startswith("image/"):
+        return "images"
+    if content_type == "application/pdf":
+        return "documents"
+    return None
+
+def upload_size(evidence_file: UploadFile) -> int:
+    if evidence_file.size is not None:
+        return evidence_file.size
+    size = evidence_file.file.seek(0, os.SEEK_END)
+    evidence_file.file.seek(0)
+    return size
+
+# The files of one report that go to storage, as (file, bucket) pairs. Empty and unsupported files are
+# skipped. Starlette has received every file by now, so an oversized one raises EvidenceTooLarge
+# before any file of the report is spooled or uploaded.
+def accepted_evidence(evidence_files: list[UploadFile], bribe_id: str,
+                      max_bytes: int = MAX_EVIDENCE_BYTES) -> list[tuple[UploadFile, str]]:
+    accepted = []
+    for evidence_file in evidence_files:
+        if not (evidence_file and evidence_file.filename):
+            continue
+        bucket_name = bucket_for(evidence_file.content_type)
+        if bucket_name is None:
+            logger.warning("Skipping unsupported file type: %s for file %s in bribe report %s", evidence_file.content_type, evidence_file.filename, bribe_id)
+            continue
+        size = upload_size(evidence_file)
+        if size == 0:
+            continue
+        if size > max_bytes:
+            raise EvidenceTooLarge(f"{evidence_file.filename} is larger than {max_bytes / (1024 * 1024):.1f} MB")
+        accepted.append((evidence_file, bucket_name))
+    return accepted
+
+# Read side of an upload for storage3, which only streams BufferedReader objects (anything else
+# is taken for a path). Reads Starlette's spooled file in place, in memory or rolled over to disk.
+class _UploadReader(io.RawIOBase):
+    def __init__(self, file):
+        self._file = file
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def readinto(self, buffer) -> int:
+        data = self._file.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+# An evidence file still held by the request, streamed to storage from Starlette's spooled upload
+@dataclass
+class RequestEvidence:
+    upload: UploadFile
+    bucket_name: str
+
+    @property
+    def filename(self) -> str:
+        return self.upload.filename
+
+    @property
+    def content_type(self) -> str:
+        return self.upload.content_type
+
+    def source(self) -> io.BufferedReader:
+        self.upload.file.seek(0)
+        return io.BufferedReader(_UploadReader(self.upload.file), CHUNK_SIZE)
+
+# An evidence file copied to local disk, so it outlives the request for the background workers
+@dataclass
+class SpooledEvidence:
+    path: str
+    filename: str
+    content_type: str
+    bucket_name: str
+
+    def source(self) -> str:
+        return self.path # storage opens the file itself
+
+def _copy_to_spool(evidence_file: UploadFile) -> str:
+    fd, path = tempfile.mkstemp(prefix="evidence-", dir=SPOOL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            evidence_file.file.seek(0)
+            shutil.copyfileobj(evidence_file.file, spool, CHUNK_SIZE)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+# Copies the uploadable files of one report to spool files for the background workers.
+# If any file is rejected nothing is spooled, a failed copy deletes the files spooled so far.
+async def spool_evidence(evidence_files: list[UploadFile], bribe_id: str) -> list[SpooledEvidence]:
+    spooled = []
+    try:
+        for evidence_file, bucket_name in accepted_evidence(evidence_files, bribe_id):
+            spool_path = await asyncio.to_thread(_copy_to_spool, evidence_file)
+            spooled.append(SpooledEvidence(spool_path, evidence_file.filename, evidence_file.content_type, bucket_name))
+    except BaseException:
+        discard_spooled(spooled)
+        raise
+    return spooled
+
+def discard_spooled(spooled: list[SpooledEvidence]) -> None:
+    for item in spooled:
+        try:
+            os.unlink(item.path)
+        except FileNotFoundError:
+            pass
+
+# Uploads the evidence of one report concurrently and returns the public URLs in file order.
+# All or nothing: if any upload fails, every path this call touched is removed (one remove call per
+# bucket) and EvidenceUploadError is raised. Spool files are left for the caller to discard.
+async def upload_spooled(supabase: AsyncClient, access_token: str, username: str, bribe_id: str,
+                         spooled: list[SpooledEvidence | RequestEvidence]) -> list[str]:
+    semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    attempted: dict[str, list[str]] = {} # bucket -> paths, recorded before upload so partial writes are cleaned too
+
+    async def upload_one(item: SpooledEvidence | RequestEvidence) -> str:
+        storage_path = f"{username}/{bribe_id}/{item.filename}"
+        bucket = scoped_bucket(supabase, item.bucket_name, access_token)
+        async with semaphore:
+            logger.info("Uploading to bucket: %s, path: %s", item.bucket_name, storage_path)
+            attempted.setdefault(item.bucket_name, []).append(storage_path)
+            # the HTTP client streams the file in chunks, from the spool path or the request's upload
+            response = await bucket.upload(
+                path=storage_path,
+                file=item.source(),
+                file_options={"content-type": item.content_type, "cache-control": "3600", "upsert": "false"}
+            )
+            logger.info("Supabase Upload Response Status for %s: %s", storage_path, response)
+            if not response:
+                raise EvidenceUploadError(f"Upload of {storage_path} returned {response}")
+            url_response = await bucket.get_public_url(storage_path)
+            logger.info("Supabase Public URL for %s: %s", storage_path, url_response)
+            return url_response
+
+    results = await asyncio.gather(*(upload_one(item) for item in spooled), return_exceptions=True)
+    failures = [r for r in results if isinstance(r, BaseException)]
+    if failures:
+        for failure in failures:
+            logger.error("Error processing evidence upload for bribe %s: %s", bribe_id, failure, exc_info=failure)
+        await remove_evidence(supabase, access_token, attempted)
+        raise EvidenceUploadError(f"{len(failures)} of {len(spooled)} evidence uploads failed for bribe {bribe_id}") from failures[0]
+    return results
+
+# Inline path: the files go to storage straight from the request before the report is committed
+async def upload_evidence(supabase: AsyncClient, access_token: str, username: str, bribe_id: str,
+                          evidence_files: list[UploadFile]) -> list[str]:
+    files = [RequestEvidence(evidence_file, bucket_name) for evidence_file, bucket_name in accepted_evidence(evidence_files, bribe_id)]
+    return await upload_spooled(supabase, access_token, username, bribe_id, files)
+
+async def remove_evidence(supabase: AsyncClient, access_token: str, paths_by_bucket: dict[str, list[str]]) -> None:
+    for bucket_name, paths in paths_by_bucket.items():
+        try:
+            await scoped_bucket(supabase, bucket_name, access_token).remove(paths)
+            logger.info("Attempted cleanup of failed upload: %s: %s", bucket_name, paths)
+        except Exception as delete_e:
+            logger.error("Error during cleanup of failed upload %s: %s: %s", bucket_name, paths, delete_e, exc_info=True)
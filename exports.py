@@ -0,0 +1,56 @@
+from typing import AsyncIterator
+from sqlmodel import select
+from .db import async_session
+from .models import Bribe
+from .queries import ListingFilters
+import csv
+import io
+import json
+import os
+
+# Rows fetched from the server-side cursor per round trip, and so the most rows held in memory
+EXPORT_BATCH_SIZE = int(os.environ.get("export_batch_size", "2000"))
+
+EXPORT_COLUMNS = (
+    Bribe.bribe_id,
+    Bribe.ofcl_name,
+    Bribe.dept,
+    Bribe.bribe_amt,
+    Bribe.state_ut,
+    Bribe.district,
+    Bribe.doi,
+    Bribe.descr,
+)
+EXPORT_FIELDS = [column.key for column in EXPORT_COLUMNS]
+
+# Matching reports in batches of EXPORT_BATCH_SIZE, read through a server-side cursor. The session
+# (and its pooled connection) stays open until the last batch is sent, so a slow download holds a
+# connection for its whole duration. Unordered, the table is read in whatever order is cheapest.
+async def _report_batches(filters: ListingFilters):
+    query = select(*EXPORT_COLUMNS).where(*filters.conditions()).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    async with async_session() as session:
+        result = await session.stream(query)
+        async for partition in result.partitions():
+            yield partition
+
+# The header goes out before the query runs, so the download starts even when a selective filter
+# takes a while to find its first batch
+async def csv_export(filters: ListingFilters) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.getvalue()
+    async for rows in _report_batches(filters):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+async def jsonl_export(filters: ListingFilters) -> AsyncIterator[str]:
+    async for rows in _report_batches(filters):
+        yield "".join(json.dumps(row._asdict(), ensure_ascii=False, default=str) + "\n" for row in rows)
+
+EXPORT_FORMATS = {
+    "csv": (csv_export, "text/csv"),
+    "jsonl": (jsonl_export, "application/x-ndjson"),
+}
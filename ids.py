@@ -0,0 +1,66 @@
+import secrets
+import time
+
+# Reporting ids are the first and last two characters of the username followed by a time ordered
+# body and a check character, e.g. "rajv" + "0h2k9c4x7m1q" + "a".
+#
+# body = milliseconds since EPOCH_MS (42 bits) | random process node (8 bits) | per-ms sequence (10 bits)
+# written as 12 lowercase Crockford base32 characters. Ids from one process never repeat, ids from
+# different processes only collide if they pick the same node in the same millisecond at the same
+# sequence number, which the insert retry in report_bribe absorbs without any lookup query.
+
+ALPHABET = "0123456789abcdefghjkmnpqrstvwxyz"
+EPOCH_MS = 1735689600000 # 2025-01-01T00:00:00Z
+NODE_BITS = 8
+SEQUENCE_BITS = 10
+BODY_LENGTH = 12
+
+def _encode(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+# Luhn mod 32 check character, catches any single mistyped character and most adjacent swaps
+def check_char(body: str) -> str:
+    total = 0
+    factor = 2
+    for char in reversed(body):
+        addend = factor * ALPHABET.index(char)
+        total += addend // 32 + addend % 32
+        factor = 1 if factor == 2 else 2
+    return ALPHABET[(32 - total % 32) % 32]
+
+class BribeIdGenerator:
+    def __init__(self, node: int | None = None):
+        self.node = secrets.randbits(NODE_BITS) if node is None else node
+        self._last_ms = 0
+        self._sequence = 0
+
+    def _next_value(self) -> int:
+        now_ms = time.time_ns() // 1_000_000 - EPOCH_MS
+        if now_ms > self._last_ms:
+            self._last_ms = now_ms
+            self._sequence = 0
+        else:
+            # same millisecond (or the clock stepped back): keep counting, borrowing the next
+            # millisecond once the sequence is used up, so values stay strictly increasing
+            self._sequence += 1
+            if self._sequence >> SEQUENCE_BITS:
+                self._last_ms += 1
+                self._sequence = 0
+        return (self._last_ms << (NODE_BITS + SEQUENCE_BITS)) | (self.node << SEQUENCE_BITS) | self._sequence
+
+    def new_id(self, username: str) -> str:
+        body = _encode(self._next_value(), BODY_LENGTH)
+        return f"{username[:2]}{username[-2:]}{body}{check_char(body)}"
+
+# Ids from before this generator are 10 characters long and carry no check character
+def is_well_formed(bribe_id: str) -> bool:
+    if len(bribe_id) != 4 + BODY_LENGTH + 1:
+        return True
+    body, check = bribe_id[4:-1], bribe_id[-1]
+    return all(c in ALPHABET for c in body) and check_char(body) == check
+
+bribe_ids = BribeIdGenerator()
@@ -0,0 +1,122 @@
+from dataclasses import dataclass, field
+from sqlalchemy import update
+from supabase import AsyncClient
+from .db import async_session
+from .models import Bribe
+from .evidence import SpooledEvidence, upload_spooled, discard_spooled
+import asyncio
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# "inline" uploads evidence before the report is committed, "background" commits the report with
+# evidence_status="pending" and lets the workers below upload the spooled files afterwards
+EVIDENCE_UPLOAD_MODE = os.environ.get("evidence_upload_mode", "inline")
+EVIDENCE_WORKERS = int(os.environ.get("evidence_workers", "2"))
+EVIDENCE_MAX_ATTEMPTS = int(os.environ.get("evidence_max_attempts", "5"))
+EVIDENCE_BACKOFF_SECONDS = float(os.environ.get("evidence_backoff_seconds", "1"))
+EVIDENCE_DRAIN_TIMEOUT = float(os.environ.get("evidence_drain_timeout", "30"))
+
+@dataclass
+class EvidenceJob:
+    bribe_id: str
+    username: str
+    access_token: str
+    files: list[SpooledEvidence]
+    attempts: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+# In-process queue of evidence uploads. Jobs live only in this worker's memory: if the process dies
+# the report stays "pending" and its spool files stay on disk.
+class EvidenceQueue:
+    def __init__(self, workers: int = EVIDENCE_WORKERS, max_attempts: int = EVIDENCE_MAX_ATTEMPTS,
+                 backoff_seconds: float = EVIDENCE_BACKOFF_SECONDS):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self._queue: asyncio.Queue[EvidenceJob] | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._supabase: AsyncClient | None = None
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+
+    def start(self, supabase: AsyncClient) -> None:
+        self._supabase = supabase
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info("Started %s evidence upload workers", self.workers)
+
+    def enqueue(self, job: EvidenceJob) -> None:
+        self._queue.put_nowait(job)
+        logger.info("Queued %s evidence files for bribe %s, queue depth %s", len(job.files), job.bribe_id, self._queue.qsize())
+
+    def stats(self) -> dict:
+        return {
+            "depth": self._queue.qsize() if self._queue else 0,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retries": self.retries,
+        }
+
+    # Waits up to timeout seconds for queued jobs to finish, then stops the workers
+    async def drain(self, timeout: float = EVIDENCE_DRAIN_TIMEOUT) -> None:
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error("Evidence queue not drained within %ss, %s jobs left pending", timeout, self._queue.qsize() + self.in_flight)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, number: int) -> None:
+        while True:
+            job = await self._queue.get()
+            self.in_flight += 1
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.error("Evidence worker %s crashed on bribe %s: %s", number, job.bribe_id, e, exc_info=True)
+            finally:
+                self.in_flight -= 1
+                self._queue.task_done()
+
+    async def _run(self, job: EvidenceJob) -> None:
+        while True:
+            job.attempts += 1
+            try:
+                urls = await upload_spooled(self._supabase, job.access_token, job.username, job.bribe_id, job.files)
+            except Exception as e:
+                if job.attempts >= self.max_attempts:
+                    logger.error("Giving up on evidence for bribe %s after %s attempts: %s", job.bribe_id, job.attempts, e)
+                    await self._finish(job, [], "failed")
+                    self.failed += 1
+                    return
+                delay = self.backoff_seconds * 2 ** (job.attempts - 1)
+                logger.warning("Evidence upload for bribe %s failed (attempt %s), retrying in %ss: %s", job.bribe_id, job.attempts, delay, e)
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            await self._finish(job, urls, "done")
+            self.completed += 1
+            logger.info("Evidence for bribe %s uploaded %.2fs after submission", job.bribe_id, time.monotonic() - job.enqueued_at)
+            return
+
+    async def _finish(self, job: EvidenceJob, urls: list[str], status: str) -> None:
+        try:
+            async with async_session() as session:
+                await session.execute(
+                    update(Bribe).where(Bribe.bribe_id == job.bribe_id).values(evidence_urls=urls, evidence_status=status)
+                )
+                await session.commit()
+        finally:
+            discard_spooled(job.files)
+
+evidence_queue = EvidenceQueue()
@@ -0,0 +1,92 @@
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+import atexit
+import copy
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+
+LOG_FILE = os.environ.get("log_file", "log0.txt")
+LOG_LEVEL = os.environ.get("log_level", "INFO").upper()
+# "json" writes one JSON object per line, "text" keeps the old human readable lines
+LOG_FORMAT = os.environ.get("log_format", "json")
+# Rotation by time when log_rotate_when is set (e.g. "midnight", "H"), otherwise by size
+LOG_ROTATE_WHEN = os.environ.get("log_rotate_when", "")
+LOG_MAX_BYTES = int(os.environ.get("log_max_bytes", str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get("log_backup_count", "5"))
+# Fraction of INFO and DEBUG records kept, warnings and errors are always written
+LOG_SAMPLE_RATE = float(os.environ.get("log_sample_rate", "1.0"))
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
+_exception_formatter = logging.Formatter()
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": f"{record.filename}:{record.lineno}",
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+# Resolves the message and traceback to plain strings before the record crosses to the listener thread,
+# keeping the traceback out of the message so the JSON formatter can put it in its own field
+class LogQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def _file_handler() -> logging.Handler:
+    if LOG_ROTATE_WHEN:
+        handler = TimedRotatingFileHandler(LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    else:
+        handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+_listener: QueueListener | None = None
+
+# Request handlers only put records on an in-memory queue, a listener thread formats them and does
+# the file writes and rotation. Records below the level or dropped by sampling are never formatted,
+# so callers should pass arguments (logger.info("... %s", value)) rather than pre-formatted strings.
+def configure_logging() -> None:
+    global _listener
+    if _listener is not None:
+        return
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(queue_handler)
+    _listener = QueueListener(log_queue, _file_handler(), respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+# Flushes whatever is still queued, registered to run at interpreter exit
+def stop_logging() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,43 +1,110 @@
 from fastapi import FastAPI, Request, Form, UploadFile, Depends, HTTPException
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, HTMLResponse, Response, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from .db import SQLModel, engine
+from .db import SQLModel, engine, async_engine, async_session, pool_status, is_duplicate_key
 from .models import User, Bribe
+from .counters import bribe_counter
+from .pagination import PAGE_SIZE, MAX_OFFSET_PAGES, InvalidCursor, encode_cursor, decode_cursor, encode_rank_cursor, decode_rank_cursor
+from .queries import listing_page, track_reports, search_reports, search_available, ListingFilters
+from .rollups import record_report, group_totals, StatsFilters
+from .exports import EXPORT_FORMATS
+from .api import router as api_router
+from .auth import local_verification_enabled, verify_access_token, token_cache
+from .supabase_scope import scoped_auth, scoped_query
+from .evidence import upload_evidence, spool_evidence, discard_spooled, EvidenceUploadError, EvidenceTooLarge
+from .jobs import evidence_queue, EvidenceJob, EVIDENCE_UPLOAD_MODE
+from .ids import bribe_ids
+from .users import user_directory
+from .username_index import username_index, USERNAME_INDEX_ENABLED
+from .page_cache import page_cache, etag_matches
+from .templating import templates, stream_template, warm_templates
+from .log_setup import configure_logging
+from .profiling import SlowQueryLog, ProfilingMiddleware, SLOW_QUERY_MS
+from .metrics import MetricsMiddleware, instrument_engine, instrument_supabase, register_gauges, render_metrics, scrape_allowed
 from sqlmodel import Session, select, func
+from sqlalchemy.exc import IntegrityError
 import datetime
+import uuid
 from starlette.middleware.sessions import SessionMiddleware
 import os
 from supabase import create_async_client
-from typing import List
+from typing import List, Literal
+from markupsafe import Markup
 import datetime
 from supabase import SupabaseAuthClient
 from pydantic import BaseModel, constr
 import logging
+import jwt
+from urllib.parse import urlencode
 
-#configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s',
-    filename='log0.txt',
-    filemode='a' 
-)
+#configure logging, writes happen on a background thread
+configure_logging()
 
 # get logger instance
 logger = logging.getLogger(__name__)
 
+# insert attempts for a new report before giving up on bribe_id clashes
+BRIBE_ID_ATTEMPTS = 3
+
 async def startup_event():
     global supabase
     url: str = os.environ.get("supabase_url")
     key: str = os.environ.get("supabase_key")
     supabase = await create_async_client(url, key)
+    instrument_supabase(supabase)
+    warm_templates()
+    if EVIDENCE_UPLOAD_MODE == "background":
+        evidence_queue.start(supabase)
+    if USERNAME_INDEX_ENABLED:
+        username_index.start()
+
+async def shutdown_event():
+    # let queued evidence uploads finish before the worker exits
+    await evidence_queue.drain()
+    await username_index.stop()
+
+# Asks Supabase whether a username is taken
+async def username_exists_remote(username: str) -> bool:
+    username_check = await supabase.rpc("check_username_exist", {"username_text": username}).execute()
+    logger.debug("Supabase RPC check_username_exist response data: %s", username_check.data)
+    return bool(username_check.data)
 
 app=FastAPI()
 app.add_event_handler("startup", startup_event) # register the startup event handler
+app.add_event_handler("shutdown", shutdown_event)
+# added before SessionMiddleware so it runs inside it and can read the signed-in user
+app.add_middleware(ProfilingMiddleware, current_user_id=lambda request: profiling_user_id(request))
 app.add_middleware(SessionMiddleware, secret_key=os.environ.get("secret_key"))
+app.add_middleware(MetricsMiddleware) # outermost, so its timings include the session middleware
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+app.include_router(api_router) # JSON API under /api/v1
 SQLModel.metadata.create_all(engine)
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+if SLOW_QUERY_MS > 0:
+    SlowQueryLog(async_engine).install()
+# Connection pool gauges for sizing db_pool_size / db_max_overflow, only exposed on /metrics
+register_gauges("db_pool", pool_status)
+# Depth and outcome counters of the background evidence upload queue
+register_gauges("evidence_queue", evidence_queue.stats)
+register_gauges("page_cache", page_cache.stats)
+
+# Exchanges the refresh token for a new session and stores it, clearing the session when that fails
+async def refresh_current_user(request: Request, refresh_token: str) -> SupabaseAuthClient | None:
+    try:
+        # refresh on a request scoped auth client, the shared client never holds a user session
+        refresh_response = await scoped_auth(supabase).refresh_session(refresh_token)
+        if refresh_response and refresh_response.session:
+            logger.info("Session refreshed successfully for user: %s", refresh_response.user.id)
+            # Update session in Starlette middleware
+            request.session["supabase_session"] = refresh_response.session.dict()
+            # Return the newly verified user
+            return refresh_response.user
+        logger.warning("Refresh token failed or returned no session.")
+    except Exception as refresh_e:
+        logger.error("Error refreshing session: %s", refresh_e, exc_info=True)
+    request.session.pop("supabase_session", None) # Clear invalid session
+    return None
 
 #Dependency to get current user from Supabase session
 async def get_current_user(request: Request) -> SupabaseAuthClient | None:
@@ -54,110 +121,145 @@ async def get_current_user(request: Request) -> SupabaseAuthClient | None:
         logger.warning("Access token missing in Supabase session data.")
         return None
 
+    if local_verification_enabled():
+        # Verify the token signature and expiry locally, the auth server is only contacted to refresh
+        try:
+            user = await verify_access_token(access_token)
+            logger.debug("User verified locally via access token: %s", user.id)
+            return user
+        except jwt.ExpiredSignatureError:
+            logger.info("Access token expired, attempting refresh")
+            if refresh_token:
+                return await refresh_current_user(request, refresh_token)
+            logger.warning("No refresh token available to refresh session.")
+            request.session.pop("supabase_session", None)
+            return None
+        except jwt.InvalidTokenError as e:
+            logger.warning("Access token failed local verification: %s", e)
+            request.session.pop("supabase_session", None)
+            return None
+        except jwt.PyJWTError as e:
+            # e.g. the JWKS endpoint could not be reached, let the auth server decide instead
+            logger.error("Local token verification unavailable, falling back to auth server: %s", e)
+
     try:
-        # Set the session for the supabase client instance for this request
-        await supabase.auth.set_session(access_token=access_token, refresh_token=refresh_token)
-        response = await supabase.auth.get_user()
+        # Pass the token per call instead of setting it on the shared supabase client
+        response = await supabase.auth.get_user(access_token)
         # user is retrieved directly from the response object
         user = response.user
         if user:
-            logger.info(f"User verified via access token: {user.id}")
+            logger.info("User verified via access token: %s", user.id)
             return user # Return the Supabase user object
-        else:
-            # If get_user returns no user despite token, try refreshing
-            logger.warning("No user found with current token, attempting refresh")
-            if refresh_token:
-                 try:
-                     refresh_response = await supabase.auth.refresh_session(refresh_token)
-                     if refresh_response and refresh_response.session:
-                         logger.info(f"Session refreshed successfully for user: {refresh_response.user.id}")
-                         # Update session in Starlette middleware
-                         request.session["supabase_session"] = refresh_response.session.dict()
-                         # Return the newly verified user
-                         return refresh_response.user
-                     else:
-                         logger.warning("Refresh token failed or returned no session.")
-                         request.session.pop("supabase_session", None) # Clear invalid session
-                         await supabase.auth.sign_out() # Clear supabase client session state
-                         return None
-                 except Exception as refresh_e:
-                     logger.error(f"Error refreshing session: {refresh_e}", exc_info=True)
-                     request.session.pop("supabase_session", None)
-                     await supabase.auth.sign_out()
-                     return None
-            else:
-                logger.warning("No refresh token available to refresh session.")
-                request.session.pop("supabase_session", None)
-                await supabase.auth.sign_out()
-                return None
-
+        # If get_user returns no user despite token, try refreshing
+        logger.warning("No user found with current token, attempting refresh")
     except Exception as e:
-        logger.error(f"Error validating session with access token: {e}", exc_info=True)
-
-        if refresh_token:
-             try:
-                 logger.warning("Attempting refresh due to session validation exception...")
-                 refresh_response = await supabase.auth.refresh_session(refresh_token)
-                 if refresh_response and refresh_response.session:
-                     logger.info(f"Session refreshed successfully after exception for user: {refresh_response.user.id}")
-                     request.session["supabase_session"] = refresh_response.session.dict()
-                     return refresh_response.user
-                 else:
-                     logger.warning("Refresh token failed or returned no session after exception.")
-                     request.session.pop("supabase_session", None)
-                     await supabase.auth.sign_out()
-                     return None
-             except Exception as refresh_e:
-                 logger.error(f"Error refreshing session after exception: {refresh_e}", exc_info=True)
-                 request.session.pop("supabase_session", None)
-                 await supabase.auth.sign_out()
-                 return None
-        else:
-            logger.warning("No refresh token available after session validation exception, clearing session.")
-            request.session.pop("supabase_session", None)
-            await supabase.auth.sign_out()
-            return None
+        logger.error("Error validating session with access token: %s", e, exc_info=True)
 
-@app.get('/')
-async def index(request:Request, page: int = 1, current_user: SupabaseAuthClient | None = Depends(get_current_user)):
-    
-    logger.info(f"Index page requested: page={page}")
-    with Session(engine) as session:
-        # Calculate the offset based on the page number.
-        offset = (page - 1) * 50
-        # Query the database, ordering by bribe_amt in descending order,
-        # limiting to 50 results per page, and applying the offset.
-        bribes = session.exec(select(Bribe).order_by(Bribe.bribe_amt.desc()).offset(offset).limit(50)).all()
+    if refresh_token:
+        return await refresh_current_user(request, refresh_token)
+    logger.warning("No refresh token available to refresh session, clearing session.")
+    request.session.pop("supabase_session", None)
+    return None
 
-        # Get total number of bribes for pagination
-        total_bribes = session.exec(select(func.count(Bribe.id))).one()  
-        total_pages = (total_bribes + 49) // 50 
-
-        # Calculate total pages and page range
-        start_page = max(1, page - 1)
-        end_page = min(total_pages, page + 1)
-        page_numbers = list(range(start_page, end_page + 1))
+# Id of the signed-in user, for the admin check of ProfilingMiddleware
+async def profiling_user_id(request: Request) -> str | None:
+    user = await get_current_user(request)
+    return user.id if user else None
 
-        bribe_data = []
-        for bribe in bribes:
-            bribe_data.append({
-                "ofcl_name": bribe.ofcl_name,
-                "dept": bribe.dept,
-                "state_ut": bribe.state_ut,
-                "district": bribe.district,
-                "bribe_amt": bribe.bribe_amt,
-                "doi": str(bribe.doi) if bribe.doi else "No Date", 
-                "bribe_id": bribe.bribe_id,
+@app.get('/')
+async def index(request:Request, page: int = 1, after: str | None = None, before: str | None = None,
+                current_user: SupabaseAuthClient | None = Depends(get_current_user)):
+    
+    logger.info("Index page requested: page=%s, after=%s, before=%s", page, after, before)
+    page = max(page, 1)
+    cursor = after or before
+    if not cursor and page > MAX_OFFSET_PAGES:
+        # Deep OFFSET scans get slower with every page, old deep links restart from the last offset page
+        logger.info("Page %s is beyond offset pagination, redirecting to page %s", page, MAX_OFFSET_PAGES)
+        return RedirectResponse(url=f"/?page={MAX_OFFSET_PAGES}", status_code=303)
+
+    after_key = before_key = None
+    if cursor:
+        try:
+            cursor_key = decode_cursor(cursor)
+        except InvalidCursor:
+            logger.warning("Invalid pagination cursor received: %s", cursor)
+            return RedirectResponse(url="/", status_code=303)
+        if after:
+            after_key = cursor_key
+        else:
+            before_key = cursor_key
+
+    # Anonymous visitors get the whole cached page (or a 304), signed-in visitors get the cached
+    # leaderboard rendered inside their own header. Either way a hit skips the database.
+    variant = "user" if current_user else "anon"
+    cacheable = page_cache.cacheable(page, cursor)
+    if_none_match = request.headers.get("if-none-match")
+    if cacheable:
+        cached = page_cache.get(page, variant)
+        if cached is not None:
+            if variant == "anon":
+                return cached_page_response(cached.body, cached.etag, if_none_match)
+            return templates.TemplateResponse("base.html", {
+                "request": request,
+                "leaderboard_html": Markup(cached.body.decode()),
+                "current_user": current_user
             })
+    generation = page_cache.generation
 
-        return templates.TemplateResponse("base.html", {
-            "request": request, 
-            "bribes": bribe_data,
-            "page": page,
-            "total_pages": total_pages,
-            "page_numbers": page_numbers,
-            "current_user": current_user
-        })
+    async with async_session() as session:
+        # Only the rendered columns are selected, rows go to the template as-is
+        bribes, has_more = await listing_page(session, page=page, after=after_key, before=before_key)
+        has_next = has_more or bool(before)
+
+        # Get total number of bribes for pagination
+        total_bribes = await bribe_counter.get(session)
+    total_pages = (total_bribes + PAGE_SIZE - 1) // PAGE_SIZE 
+
+    # Calculate total pages and page range, only pages reachable by offset get direct links
+    start_page = max(1, page - 1)
+    end_page = min(total_pages, page + 1)
+    page_numbers = [p for p in range(start_page, end_page + 1) if p <= MAX_OFFSET_PAGES or p == page]
+
+    next_url = None
+    if has_next and bribes:
+        next_url = f"/?page={page + 1}&after={encode_cursor(bribes[-1].bribe_amt, bribes[-1].bribe_id)}"
+    prev_url = None
+    if page > 1:
+        if page - 1 <= MAX_OFFSET_PAGES or not bribes:
+            prev_url = f"/?page={min(page - 1, MAX_OFFSET_PAGES)}"
+        else:
+            prev_url = f"/?page={page - 1}&before={encode_cursor(bribes[0].bribe_amt, bribes[0].bribe_id)}"
+
+    context = {
+        "request": request, 
+        "bribes": bribes,
+        "page": page,
+        "total_pages": total_pages,
+        "page_numbers": page_numbers,
+        "next_url": next_url,
+        "prev_url": prev_url,
+        "current_user": current_user
+    }
+    if cacheable and variant == "user":
+        leaderboard_html = templates.get_template("leaderboard.html").render(context)
+        page_cache.put(page, variant, leaderboard_html.encode(), generation)
+        context["leaderboard_html"] = Markup(leaderboard_html)
+    response = templates.TemplateResponse("base.html", context)
+    if cacheable and variant == "anon":
+        cached = page_cache.put(page, variant, response.body, generation)
+        if etag_matches(if_none_match, cached.etag):
+            return Response(status_code=304, headers={"ETag": cached.etag})
+        response.headers["ETag"] = cached.etag
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# Serves a cached anonymous index page, browsers revalidate with If-None-Match on every visit
+def cached_page_response(body: bytes, etag: str, if_none_match: str | None) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(body, headers=headers)
 
 @app.get('/report')
 async def report(request:Request, current_user: SupabaseAuthClient | None = Depends(get_current_user)):
@@ -193,11 +295,13 @@ async def report_bribe(request: Request,
         return RedirectResponse(url="/", status_code=303)
 
     username = current_user.user_metadata.get("username")
-    logger.info(f"User '{username}' attempting to report a bribe.")
+    logger.info("User '%s' attempting to report a bribe.", username)
     
-    with Session(engine) as session:
-        user = session.exec(select(User).where(User.username == username)).first()
+    # The public user row shares its id with the Supabase auth user, so no lookup is needed.
+    # The username comes from user_metadata, which the user can edit, so it must not feed user_directory.
+    user_id = uuid.UUID(str(current_user.id))
 
+    async with async_session() as session:
         if official is None:
             official = "*UNKNOWN"
 
@@ -208,34 +312,6 @@ async def report_bribe(request: Request,
             except ValueError:
                 return JSONResponse({"error": "Invalid date format"}, status_code=422) # Return error if date format is invalid
             
-        # generate bribe_id
-        import uuid
-        uuid_str = str(uuid.uuid4())
-        numeric_uuid_chars = ''.join(filter(str.isdigit, uuid_str))
-        import random
-        if len(numeric_uuid_chars) >= 6:
-            first_six_digits = ''.join(random.sample(numeric_uuid_chars, 6))
-        else:
-            first_six_digits = numeric_uuid_chars.zfill(6)
-
-        bribe_id_candidate = f"{username[:2]}{username[-2:]}{first_six_digits}"
-        logger.info(f"Generated Candidate BRIBE ID: {bribe_id_candidate}")
-
-        # Collision check for the user-facing bribe_id
-        while True:
-            existing_bribe = session.exec(select(Bribe).where(Bribe.bribe_id == bribe_id_candidate)).first()
-            if not existing_bribe:
-                break
-            else:
-                logger.warning(f"Collision detected for BRIBE ID: {bribe_id_candidate}. Regenerating...")
-                    # Regenerate using a different sample
-                if len(numeric_uuid_chars) >= 6:
-                    first_six_digits = ''.join(random.sample(numeric_uuid_chars, 6))
-                else:
-                    first_six_digits = numeric_uuid_chars.zfill(6)
-                bribe_id_candidate = f"{username[:2]}{username[-2:]}{first_six_digits}"
-                logger.info(f"Regenerated Candidate BRIBE ID: {bribe_id_candidate}")
-
         bribe = Bribe(
             ofcl_name=official,
             dept=department,
@@ -246,97 +322,75 @@ async def report_bribe(request: Request,
             descr=description,
             doi=parsed_date,
             # evidence_urls will be added after upload
-            bribe_id=bribe_id_candidate, 
-            id=user.id 
+            id=user_id 
         )
 
-        # Add bribe to the session 
-        session.add(bribe)
+        # bribe_id is unique by construction, the row is inserted right away and a (very unlikely)
+        # clash between workers just retries with the next id instead of checking with a SELECT first.
+        # bribe_id is the only unique key of bribe, any other integrity error is not retried.
+        for attempt in range(1, BRIBE_ID_ATTEMPTS + 1):
+            bribe_id_candidate = bribe_ids.new_id(username)
+            bribe.bribe_id = bribe_id_candidate
+            session.add(bribe)
+            try:
+                await session.flush()
+                break
+            except IntegrityError as e:
+                await session.rollback()
+                if not is_duplicate_key(e, "bribe"):
+                    raise
+                logger.warning("BRIBE ID %s already taken (attempt %s): %s", bribe_id_candidate, attempt, e)
+        else:
+            logger.error("Could not insert bribe report for user '%s' after %s attempts.", username, BRIBE_ID_ATTEMPTS)
+            return JSONResponse({"error": "Failed to save the report. Please try again."}, status_code=500)
+        logger.info("Generated BRIBE ID: %s", bribe_id_candidate)
 
         evidence_public_urls = []
+        spooled_evidence = [] # only used when evidence is uploaded in the background
         upload_successful = True # Flag to track upload status
+        upload_error, upload_error_status = "Failed to upload evidence files. Please try submitting the report again.", 500
 
         try:
             if evidence_files:
-                logger.info(f"Processing {len(evidence_files)} evidence files for bribe report {bribe_id_candidate}.")
-                for evidence_file in evidence_files:
-                     if evidence_file and evidence_file.filename and await evidence_file.read(): # Check if file has content
-                        await evidence_file.seek(0) # Reset pointer after read check
-                        contents = await evidence_file.read()
-                        await evidence_file.seek(0) # Reset again for upload
-
-                        original_filename = evidence_file.filename
-                        content_type = evidence_file.content_type
-
-                        if content_type and content_type.startswith("image/"):
-                            bucket_name = "images"
-                        elif content_type == "application/pdf":
-                            bucket_name = "documents"
-                        else:
-                            logger.warning(f"Skipping unsupported file type: {content_type} for file {original_filename} in bribe report {bribe_id_candidate}")
-                            continue
-
-                        # Use authenticated username from session and bribe_id
-                        username=current_user.user_metadata.get("username")
-                        storage_path = f"{username}/{bribe_id_candidate}/{original_filename}"
-                        logger.info(f"Uploading to bucket: {bucket_name}, path: {storage_path}")
-
-                        # Set session for storage interaction 
-                        await supabase.auth.set_session(access_token=request.session.get("supabase_session", {}).get("access_token"),
-                                                         refresh_token=request.session.get("supabase_session", {}).get("refresh_token"))
-
-                        response = await supabase.storage.from_(bucket_name).upload(
-                            path=storage_path,
-                            file=contents,
-                            file_options={"content-type": evidence_file.content_type, "cache-control": "3600", "upsert": "false"}
-                        )                    
-                        logger.info(f"Supabase Upload Response Status for {storage_path}: {response}") # Assuming response gives status
-                    
-                        try:
-                            # Attempt to get public URL if upload successful
-            
-                            if response: 
-                                url_response = await supabase.storage.from_(bucket_name).get_public_url(storage_path)
-                                logger.info(f"Supabase Public URL for {storage_path}: {url_response}")
-                                evidence_public_urls.append(url_response)
-                            else:
-                                # This else block might not be reached if upload raises exception on failure
-                                logger.error(f"Error uploading file {original_filename} for bribe {bribe_id_candidate}. Status: {response}") # Log detailed error if possible
-                                upload_successful = False
-                                # Attempt cleanup 
-                                try:
-                                    await supabase.storage.from_(bucket_name).remove([storage_path])
-                                    logger.info(f"Attempted cleanup of failed upload: {storage_path}")
-                                except Exception as delete_e:
-                                    logger.error(f"Error during cleanup of failed upload {storage_path}: {delete_e}", exc_info=True)
-                                break # Stop processing further files
-                        except Exception as upload_detail_err:
-                            # Catch potential errors during upload or getting URL
-                            logger.error(f"Error processing upload for file {original_filename} for bribe {bribe_id_candidate}: {upload_detail_err}", exc_info=True)
-                            upload_successful = False
-                            # Attempt cleanup if storage_path was defined
-                            if 'storage_path' in locals():
-                                try:
-                                    await supabase.storage.from_(bucket_name).remove([storage_path])
-                                    logger.info(f"Attempted cleanup after error processing upload: {storage_path}")
-                                except Exception as delete_e:
-                                    logger.error(f"Error during cleanup after error processing upload {storage_path}: {delete_e}", exc_info=True)
-                            break
-
+                logger.info("Processing %s evidence files for bribe report %s.", len(evidence_files), bribe_id_candidate)
+                if EVIDENCE_UPLOAD_MODE == "background":
+                    # Files are only spooled to disk here, the evidence workers upload them after the commit
+                    spooled_evidence = await spool_evidence(evidence_files, bribe_id_candidate)
+                else:
+                    # Files go to storage concurrently, a failure removes everything already uploaded
+                    evidence_public_urls = await upload_evidence(supabase, request.session.get("supabase_session", {}).get("access_token"),
+                                                                 username, bribe_id_candidate, evidence_files)
+        except EvidenceTooLarge as e:
+            logger.warning("Rejected oversized evidence for bribe %s: %s", bribe_id_candidate, e)
+            upload_successful = False
+            upload_error, upload_error_status = f"Evidence file too large: {e}", 413
+        except EvidenceUploadError as e:
+            logger.error("Evidence upload failed for bribe %s: %s", bribe_id_candidate, e)
+            upload_successful = False
         except Exception as e:
-            logger.error(f"An unexpected error occurred during file upload process for bribe {bribe_id_candidate}: {e}", exc_info=True)
+            logger.error("An unexpected error occurred during file upload process for bribe %s: %s", bribe_id_candidate, e, exc_info=True)
             upload_successful = False
 
         if upload_successful:
-            logger.info(f"All uploads successful or no files to upload for bribe {bribe_id_candidate}.")
+            logger.info("All uploads successful or no files to upload for bribe %s.", bribe_id_candidate)
             
-            # Update the bribe object with the generated bribe_id and evidence URLs
-            bribe.bribe_id = bribe_id_candidate
+            # Update the bribe object with the evidence URLs
             bribe.evidence_urls = evidence_public_urls
-            logger.info(f"FINAL BRIBE before commit: {bribe}") 
+            if spooled_evidence:
+                bribe.evidence_status = "pending"
+            await record_report(session, bribe) # dashboard totals, committed together with the report
+            logger.debug("Committing bribe report %s", bribe.bribe_id)
 
-            session.commit()
-            logger.info(f"Bribe report {bribe.bribe_id} committed successfully by user '{username}'.")
+            try:
+                await session.commit()
+            except Exception:
+                discard_spooled(spooled_evidence)
+                raise
+            bribe_counter.record_insert()
+            page_cache.invalidate() # the new report may belong on one of the cached pages
+            if spooled_evidence:
+                evidence_queue.enqueue(EvidenceJob(bribe.bribe_id, username, request.session.get("supabase_session", {}).get("access_token"), spooled_evidence))
+            logger.info("Bribe report %s committed successfully by user '%s'.", bribe.bribe_id, username)
 
             # Pass current_user to the template context
             return templates.TemplateResponse("bribe_reported.html", {
@@ -346,65 +400,42 @@ async def report_bribe(request: Request,
             })
         else:
             # If any upload failed, ROLLBACK the transaction
-            logger.error(f"Upload failed for bribe report by '{username}'. Rolling back database changes.")
-            session.rollback()
+            logger.error("Upload failed for bribe report by '%s'. Rolling back database changes.", username)
+            await session.rollback()
 
             # Re-render report form with error, also needs current_user
             current_date = datetime.date.today()
             formatted_date = current_date.strftime('%Y-%m-%d')
             return templates.TemplateResponse("report.html", {
                 "request": request,
-                "error": "Failed to upload evidence files. Please try submitting the report again.",
+                "error": upload_error,
                 "current_date": formatted_date,
                 "current_user": current_user,
-            }, status_code=500)
+            }, status_code=upload_error_status)
 
 @app.post('/track_bribe')
 async def track_bribe(request: Request, username: str = Form(None), reportingId: str = Form(None), current_user: SupabaseAuthClient | None = Depends(get_current_user)):
-    with Session(engine) as session:
+    async with async_session() as session:
         
         clean_username = username.strip() if username else None
         clean_reporting_id = reportingId.strip() if reportingId else None
-        logger.info(f"Tracking bribe request received. Username: '{clean_username}', Reporting ID: '{clean_reporting_id}'")
-        bribes = []
-        query_description = ""
+        logger.info("Tracking bribe request received. Username: '%s', Reporting ID: '%s'", clean_username, clean_reporting_id)
         if clean_username and clean_reporting_id: # Both username and reportingId are provided
             query_description = f"specific bribe ID '{clean_reporting_id}' for user '{clean_username}' and other bribes by user"
-            logger.info(f"Tracking: {query_description}")
-            # Get the specific bribe by ID for this user
-            bribe_by_id = session.exec(select(Bribe).where(Bribe.bribe_id == clean_reporting_id, Bribe.user.has(username=clean_username))).first()
-            logger.debug(f"Result for specific bribe ID: {bribe_by_id}")
-            
-            if bribe_by_id:
-                # Get all other bribes for this user, excluding the one we already found, ordered by date descending
-                other_bribes = session.exec(
-                    select(Bribe)
-                    .where(Bribe.user.has(username=clean_username), Bribe.bribe_id != clean_reporting_id)
-                    .order_by(Bribe.bribe_amt.desc())
-                ).all()
-                
-                # Add the specific bribe first, then the rest
-                bribes.append(bribe_by_id)
-                bribes.extend(other_bribes)
-
         elif clean_username:
             query_description = f"all bribes for user '{clean_username}'"
-            logger.info(f"Tracking: {query_description}")
-            user_bribes = session.exec(select(Bribe).where(Bribe.user.has(username=username))).all()
-            logger.debug(f"Found {len(user_bribes)} bribes for user '{clean_username}'")
-            if user_bribes:
-                bribes.extend(user_bribes)
-
         elif clean_reporting_id:
             query_description = f"bribe with ID '{clean_reporting_id}'"
-            logger.info(f"Tracking: {query_description}")
-            bribe_by_id = session.exec(select(Bribe).where(Bribe.bribe_id == clean_reporting_id)).first()
-            logger.debug(f"Result for specific bribe ID: {bribe_by_id}")
-            if bribe_by_id:
-                bribes.append(bribe_by_id)
+        else:
+            query_description = "no username or reporting ID"
+        logger.info("Tracking: %s", query_description)
+
+        # One query for the user id and one for the reports with their user eagerly joined
+        bribes = await track_reports(session, username=clean_username, reporting_id=clean_reporting_id)
+        logger.debug("Found %s bribes for query: %s", len(bribes), query_description)
 
         if not bribes:
-            logger.warning(f"No bribe reports found for query: {query_description}")
+            logger.warning("No bribe reports found for query: %s", query_description)
             return JSONResponse({"error": "No reports found for the provided information."}, status_code=404)
         
         bribe_data = []
@@ -421,14 +452,95 @@ async def track_bribe(request: Request, username: str = Form(None), reportingId:
                 "description": bribe.descr,
                 "date": str(bribe.doi) if bribe.doi else None,
                 "evidence_urls": bribe.evidence_urls, 
+                "evidence_status": bribe.evidence_status,
                 "bribe_id": bribe.bribe_id,
             })
 
-        logger.info(f"Returning {len(bribe_data)} bribe reports for query: {query_description}")
+        logger.info("Returning %s bribe reports for query: %s", len(bribe_data), query_description)
         # logger.debug(f"Bribe data returned: {bribe_data}"
         context = {"request": request, "bribes": bribe_data, "current_user": current_user} 
 
-        return templates.TemplateResponse("track_report.html", context)
+        # can be hundreds of rows, streamed as it renders instead of buffered
+        return stream_template("track_report.html", context)
+
+# Filtered report listing as JSON, ordered by amount like the leaderboard and paged with the same
+# keyset cursor. Follow "next" until it is null to read every matching report.
+@app.get('/reports')
+async def filtered_reports(filters: ListingFilters = Depends(), after: str | None = None):
+    after_key = None
+    if after:
+        try:
+            after_key = decode_cursor(after)
+        except InvalidCursor:
+            logger.warning("Invalid listing cursor received: %s", after)
+            return JSONResponse({"error": "Invalid cursor."}, status_code=400)
+
+    async with async_session() as session:
+        rows, has_more = await listing_page(session, after=after_key, filters=filters)
+
+    next_url = None
+    if has_more:
+        cursor = encode_cursor(rows[-1].bribe_amt, rows[-1].bribe_id)
+        next_url = "/reports?" + urlencode({**filters.query_params(), "after": cursor})
+    reports = [{**row._asdict(), "doi": row.doi.isoformat() if row.doi else None} for row in rows]
+    return JSONResponse({"reports": reports, "next": next_url})
+
+# Matching reports as a CSV or JSON Lines download for signed-in users, streamed from a
+# server-side cursor so memory use doesn't grow with the size of the export
+@app.get('/export')
+async def export_reports(format: Literal["csv", "jsonl"] = "csv", filters: ListingFilters = Depends(),
+                         current_user: SupabaseAuthClient | None = Depends(get_current_user)):
+    if not current_user:
+        logger.warning("Unauthorized attempt to export reports.")
+        return JSONResponse({"error": "Sign in to export reports."}, status_code=401)
+    logger.info("Export of reports as %s requested by %s with filters %s", format, current_user.id, filters.query_params())
+    export, media_type = EXPORT_FORMATS[format]
+    filename = f"bribe-reports-{datetime.date.today().isoformat()}.{format}"
+    return StreamingResponse(export(filters), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+# Full-text search over official name, department and description, best matches first
+@app.get('/search')
+async def search(q: str = "", after: str | None = None):
+    q = q.strip()
+    if not q or len(q) > 200:
+        return JSONResponse({"error": "Search text must be between 1 and 200 characters."}, status_code=400)
+    after_key = None
+    if after:
+        try:
+            after_key = decode_rank_cursor(after)
+        except InvalidCursor:
+            logger.warning("Invalid search cursor received: %s", after)
+            return JSONResponse({"error": "Invalid cursor."}, status_code=400)
+
+    async with async_session() as session:
+        if not await search_available(session):
+            logger.error("Search requested but bribe.descr_tsv is missing, run the alembic migrations")
+            return JSONResponse({"error": "Search is not available."}, status_code=503)
+        rows, has_more = await search_reports(session, q, after=after_key)
+
+    next_url = None
+    if has_more:
+        next_url = "/search?" + urlencode({"q": q, "after": encode_rank_cursor(rows[-1].rank, rows[-1].bribe_id)})
+    reports = [{**row._asdict(), "doi": row.doi.isoformat() if row.doi else None} for row in rows]
+    return JSONResponse({"reports": reports, "next": next_url})
+
+# Report totals grouped by state, district, department or month, read from the rollup table only
+@app.get('/stats')
+async def stats(by: Literal["state", "district", "dept", "month"] = "state", filters: StatsFilters = Depends()):
+    async with async_session() as session:
+        groups = await group_totals(session, by, filters)
+    return JSONResponse({"by": by, "groups": groups})
+
+# Prometheus scrape endpoint, per worker. Restricted to metrics_token / metrics_allow, the gauges
+# include the connection pool and evidence queue state.
+@app.get('/metrics')
+async def metrics(request: Request):
+    client_host = request.client.host if request.client else None
+    if not scrape_allowed(client_host, request.headers.get("authorization", "")):
+        logger.warning("Metrics scrape refused for %s", client_host)
+        return PlainTextResponse("Forbidden", status_code=403)
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 # Pydantic model for request body validation
 class UsernameCheckRequest(BaseModel):
@@ -438,20 +550,21 @@ class UsernameCheckRequest(BaseModel):
 async def check_username_availability(request: Request, username_data: UsernameCheckRequest):
    
     username_to_check = username_data.username.lower()
-    logger.info(f"Checking username availability for: '{username_to_check}'")
+    logger.info("Checking username availability for: '%s'", username_to_check)
 
     try:
-        username_check = await supabase.rpc("check_username_exist", {"username_text": username_to_check}).execute()
-        logger.debug(f"Supabase RPC check_username_exist response data: {username_check.data}")
+        # Names missing from the local index are available without a remote call,
+        # possible hits are confirmed by the RPC (shared between concurrent identical checks)
+        exists = await username_index.exists(username_to_check, lambda: username_exists_remote(username_to_check))
 
         # The RPC returns true if username exists, so availability is the opposite
-        is_available = not username_check.data
-        logger.info(f"Username '{username_to_check}' availability: {is_available}")
+        is_available = not exists
+        logger.info("Username '%s' availability: %s", username_to_check, is_available)
 
         return JSONResponse({"available": is_available}, status_code=200)
 
     except Exception as e:
-        logger.error(f"Error checking username availability for '{username_to_check}': {e}", exc_info=True)
+        logger.error("Error checking username availability for '%s': %s", username_to_check, e, exc_info=True)
        
         return JSONResponse({"error": "Failed to check username availability", "details": str(e)}, status_code=500)
 
@@ -465,51 +578,59 @@ async def signup(request: Request, username_data:dict):
 
     password = username_data.get('password')
     if not password:
-        logger.error(f"Signup attempt failed for user '{username}': Password missing.")
+        logger.error("Signup attempt failed for user '%s': Password missing.", username)
         return JSONResponse({"error": "Password is required"}, status_code=400)
 
-    logger.info(f"Signup attempt for username: '{username}'")
+    logger.info("Signup attempt for username: '%s'", username)
 
     # Check if username already exists via RPC
     try:
         username_check = await supabase.rpc("check_username_exist", {"username_text": username}).execute()
-        logger.debug(f"Username check RPC response for '{username}': {username_check.data}")
+        logger.debug("Username check RPC response for '%s': %s", username, username_check.data)
 
         if username_check.data:
-            logger.warning(f"Signup attempt failed for '{username}': Username already exists.")
+            logger.warning("Signup attempt failed for '%s': Username already exists.", username)
             return JSONResponse({"error": "Username already exists"}, status_code=409) # Return 409 conflict status code
 
     except Exception as rpc_e:
-        logger.error(f"Error checking username existence via RPC during signup for '{username}': {rpc_e}", exc_info=True)
+        logger.error("Error checking username existence via RPC during signup for '%s': %s", username, rpc_e, exc_info=True)
         return JSONResponse({"error": "Failed to verify username availability. Please try again."}, status_code=500)
 
     # Proceed with signup if username is available
-    logger.info(f"Username '{username}' is available, proceeding with signup.")
+    logger.info("Username '%s' is available, proceeding with signup.", username)
     email = f"{username}@{username}.com" # Using derived email
 
     try:
         
-        logger.info(f"Attempting Supabase Auth signup for email '{email}'.")
-        response1 = await supabase.auth.sign_up(
+        logger.info("Attempting Supabase Auth signup for email '%s'.", email)
+        response1 = await scoped_auth(supabase).sign_up(
             {
                 "email": email,
                 "password": password,
                 "options": {"data":{"username": username}}
             }
         ) 
-        logger.info(f"Supabase Auth signup successful for user '{username}', User ID: {response1.user.id}")
+        logger.info("Supabase Auth signup successful for user '%s', User ID: %s", username, response1.user.id)
         #logger.debug(f"Supabase Auth signup response: {response1}") 
   
-        logger.info(f"Inserting user record into public table for user '{username}', ID: {response1.user.id}")
-        response2= await supabase.table("user").insert({"username": username, "id": response1.user.id}).execute()
-        logger.info(f"Public user table insert successful for user '{username}'.")
+        logger.info("Inserting user record into public table for user '%s', ID: %s", username, response1.user.id)
+        # sign_up ran on a scoped client, so the shared one is still anonymous: the insert carries
+        # the new user's token itself, as row level security on the user table expects
+        insert_query = supabase.table("user").insert({"username": username, "id": response1.user.id})
+        if response1.session:
+            insert_query = scoped_query(insert_query, response1.session.access_token)
+        response2= await insert_query.execute()
+        user_directory.invalidate(username)
+        user_directory.remember(username, response1.user.id)
+        username_index.add(username)
+        logger.info("Public user table insert successful for user '%s'.", username)
         #logger.debug(f"Public table insert response: {response2}")
 
         return JSONResponse({"message": "Account created successfully"}, status_code=200)
 
     except Exception as e:
         
-        logger.error(f"Error during signup process for username '{username}': {e}", exc_info=True)
+        logger.error("Error during signup process for username '%s': %s", username, e, exc_info=True)
         
         return JSONResponse({"error": f"An error occurred during signup: {e}"}, status_code=500)
         
@@ -518,11 +639,11 @@ async def signin(request: Request, username_data:dict):
     username = username_data.get('username').lower()
     password = username_data.get('password').lower()
 
-    logger.info(f"Signin attempt for username: '{username}'")
+    logger.info("Signin attempt for username: '%s'", username)
     email = f"{username}@{username}.com" 
 
     try:
-        response = await supabase.auth.sign_in_with_password(
+        response = await scoped_auth(supabase).sign_in_with_password(
             {"email": email, "password": password}
         )
         # logger.debug(f"Supabase signin response user: {response.user}")
@@ -535,25 +656,20 @@ async def signin(request: Request, username_data:dict):
                 "refresh_token": response.session.refresh_token,
                 "username": response.user.user_metadata.get("username", username) 
             }
-            logger.info(f"User '{username}' signed in successfully. Supabase session stored in Starlette session.")
+            logger.info("User '%s' signed in successfully. Supabase session stored in Starlette session.", username)
         
             return JSONResponse({"message": "Login successful", "redirect_url": "/"}) 
         else:
              
-             logger.warning(f"Signin failed for '{username}': Supabase response indicates no user or session, but no exception raised.")
+             logger.warning("Signin failed for '%s': Supabase response indicates no user or session, but no exception raised.", username)
              return JSONResponse({"error": "Invalid credentials or user not found."}, status_code=401)
 
     except Exception as e:
         
-        logger.error(f"Signin failed for username '{username}': {e}", exc_info=True) # Log stack trace for debug
+        logger.error("Signin failed for username '%s': %s", username, e, exc_info=True) # Log stack trace for debug
 
         # Clear any potentially partially set session data on failure
         request.session.pop("supabase_session", None)
-        try:
-            await supabase.auth.sign_out() # Ensure Supabase client state is cleared
-            logger.info("Cleared Supabase client state after signin failure.")
-        except Exception as signout_e:
-            logger.error(f"Error during Supabase signout cleanup after failed signin: {signout_e}", exc_info=True)
 
         return JSONResponse({"error": str(e)}, status_code=401)
 
@@ -565,23 +681,19 @@ async def signout(request: Request):
 
     # Clear the Starlette session
     supabase_session_cleared = request.session.pop("supabase_session", None) is not None
-    logger.info(f"Signing out user: '{username_for_log}'. Starlette session cleared: {supabase_session_cleared}")
+    logger.info("Signing out user: '%s'. Starlette session cleared: %s", username_for_log, supabase_session_cleared)
 
     try:
-        #  invalidate the supabase tokens
-        response = await supabase.auth.sign_out()
+        #  invalidate the supabase tokens of this user, not whatever session a shared client holds
+        if session_data and session_data.get("access_token"):
+            token_cache.discard(session_data["access_token"])
+            response = await supabase.auth.admin.sign_out(session_data["access_token"])
         # logger.debug(f"Supabase signout response: {response}"), Should be None on success
-        logger.info(f"Supabase signout successful for user '{username_for_log}'.")
+        logger.info("Supabase signout successful for user '%s'.", username_for_log)
 
         return RedirectResponse(url="/", status_code=303)
 
     except Exception as e:
-        logger.error(f"Error during Supabase sign-out for user '{username_for_log}': {e}", exc_info=True)
+        logger.error("Error during Supabase sign-out for user '%s': %s", username_for_log, e, exc_info=True)
         # Still redirect even if Supabase signout fails, as local session is cleared
         return RedirectResponse(url="/", status_code=303)
-
-
-
-
-
-
@@ -0,0 +1,201 @@
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from supabase import AsyncClient
+import bisect
+import httpx
+import ipaddress
+import os
+import secrets
+import time
+
+# Request latency and per-request SQL / Supabase accounting, kept in process memory and rendered in
+# the Prometheus text format by render_metrics(). Each worker reports its own numbers.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+# /metrics answers scrapers that send metrics_token as a bearer token or connect from an address in
+# metrics_allow (comma separated addresses or networks). Without either setting only local scrapers get it.
+METRICS_TOKEN = os.environ.get("metrics_token", "")
+METRICS_ALLOW = [ipaddress.ip_network(network.strip()) for network in os.environ.get("metrics_allow", "127.0.0.1,::1").split(",") if network.strip()]
+
+def scrape_allowed(client_host: str | None, authorization: str) -> bool:
+    if METRICS_TOKEN and secrets.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        return True
+    try:
+        address = ipaddress.ip_address(client_host or "")
+    except ValueError:
+        return False
+    return any(address in network for network in METRICS_ALLOW)
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per bucket counts..., +Inf count, sum]
+        self._series: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *label_values) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                le = _labels((*self.labels, "le"), (*label_values, bound))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Time from request start to the last body byte sent", ("route", "method", "status"))
+REQUEST_SQL_STATEMENTS = Histogram("http_request_sql_statements", "SQL statements executed per request", ("route",), COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram("http_request_sql_seconds", "Time spent executing SQL per request", ("route",))
+REQUEST_SUPABASE_SECONDS = Histogram("http_request_supabase_seconds", "Time spent waiting on Supabase per request", ("route",))
+SQL_STATEMENTS = Counter("sql_statements_total", "SQL statements executed, inside and outside requests")
+SQL_SECONDS = Counter("sql_seconds_total", "Time spent executing SQL, inside and outside requests")
+SUPABASE_LATENCY = Histogram("supabase_call_duration_seconds", "Supabase API calls by service (auth, storage, rest)", ("service", "status"))
+
+_METRICS = (REQUEST_LATENCY, REQUEST_SQL_STATEMENTS, REQUEST_SQL_SECONDS, REQUEST_SUPABASE_SECONDS,
+            SQL_STATEMENTS, SQL_SECONDS, SUPABASE_LATENCY)
+
+@dataclass
+class RequestStats:
+    sql_statements: int = 0
+    sql_seconds: float = 0.0
+    supabase_seconds: float = 0.0
+
+# Set by the middleware for the duration of a request, SQL and Supabase hooks add to it
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            # the route template, not the raw path, so /static/<file> and cursors don't explode the label set
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.observe(elapsed, route, scope["method"], status)
+            REQUEST_SQL_STATEMENTS.observe(stats.sql_statements, route)
+            REQUEST_SQL_SECONDS.observe(stats.sql_seconds, route)
+            REQUEST_SUPABASE_SECONDS.observe(stats.supabase_seconds, route)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["metrics_query_start"].pop()
+    SQL_STATEMENTS.inc()
+    SQL_SECONDS.inc(amount=elapsed)
+    stats = current_request.get()
+    if stats is not None:
+        stats.sql_statements += 1
+        stats.sql_seconds += elapsed
+
+def _on_error(exception_context):
+    starts = exception_context.connection.info.get("metrics_query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+def instrument_engine(engine: Engine) -> None:
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _on_error)
+
+def _supabase_service(url: httpx.URL) -> str:
+    # /auth/v1/..., /storage/v1/..., /rest/v1/...
+    parts = url.path.strip("/").split("/")
+    return parts[0] if parts and parts[0] else "other"
+
+async def _on_supabase_request(request: httpx.Request) -> None:
+    request.extensions["metrics_start"] = time.perf_counter()
+
+async def _on_supabase_response(response: httpx.Response) -> None:
+    start = response.request.extensions.get("metrics_start")
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    SUPABASE_LATENCY.observe(elapsed, _supabase_service(response.request.url), response.status_code)
+    stats = current_request.get()
+    if stats is not None:
+        stats.supabase_seconds += elapsed
+
+# Times every call made through the client's auth, storage and PostgREST HTTP clients. Request scoped
+# auth clients and storage buckets reuse these HTTP clients, so they are covered too.
+def instrument_supabase(supabase: AsyncClient) -> None:
+    for http_client in {id(c): c for c in (supabase.auth._http_client, supabase.storage.session, supabase.postgrest.session)}.values():
+        http_client.event_hooks["request"].append(_on_supabase_request)
+        http_client.event_hooks["response"].append(_on_supabase_response)
+
+# Point-in-time values from other modules (pool, queue, caches) exported as gauges
+_gauge_sources: list[tuple[str, Callable[[], dict]]] = []
+
+def register_gauges(prefix: str, source: Callable[[], dict]) -> None:
+    _gauge_sources.append((prefix, source))
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    for prefix, source in _gauge_sources:
+        for key, value in source().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f"# TYPE {prefix}_{key} gauge")
+            lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,4 @@
-from sqlmodel import Field, SQLModel, Relationship, JSON, Column
+from sqlmodel import Field, SQLModel, Relationship, JSON, Column, Index, BigInteger
 import datetime
 from typing import List
 import uuid
@@ -11,6 +11,16 @@ class User(SQLModel, table=True):
     username: str = Field(index=True, max_length=20, unique=True)
     
 class Bribe(SQLModel, table=True):
+    # (bribe_amt, bribe_id) backs the keyset pagination of the leaderboard and is the cursor, the
+    # others serve track_bribe's per-user query and the filtered listing (see queries.ListingFilters)
+    __table_args__ = (
+        Index("ix_bribe_bribe_amt_bribe_id", "bribe_amt", "bribe_id"),
+        Index("ix_bribe_id_bribe_amt", "id", "bribe_amt"),
+        Index("ix_bribe_state_ut_bribe_amt", "state_ut", "bribe_amt", "bribe_id"),
+        Index("ix_bribe_state_ut_district_bribe_amt", "state_ut", "district", "bribe_amt", "bribe_id"),
+        Index("ix_bribe_dept_bribe_amt", "dept", "bribe_amt", "bribe_id"),
+        Index("ix_bribe_doi", "doi"),
+    )
     user: User = Relationship(back_populates="bribes")
     ofcl_name: str | None = None
     dept: str
@@ -21,7 +31,18 @@ class Bribe(SQLModel, table=True):
     descr: str = Field(max_length= 3000)
     doi: datetime.date | None = None
     evidence_urls: List[str] = Field(default_factory=list, sa_column=Column(JSON))
+    # "pending" while background workers upload the evidence, then "done" or "failed"; None for inline uploads
+    evidence_status: str | None = Field(default=None, max_length=10)
     bribe_id: str | None = Field(default=None, primary_key=True, unique=True )
     id: uuid.UUID = Field( foreign_key="user.id")
 
-
+# Report totals per (state, district, department, month of incident), kept up to date by report_bribe
+# and rebuilt from the bribe table by `python -m package.rollups rebuild`. See rollups.py.
+class BribeStat(SQLModel, table=True):
+    state_ut: str = Field(primary_key=True)
+    district: str = Field(primary_key=True)
+    dept: str = Field(primary_key=True)
+    month: str = Field(primary_key=True, max_length=7) # "YYYY-MM" of doi, or "unknown"
+    report_count: int = 0
+    amount_total: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, server_default="0"))
+    amount_max: int = 0
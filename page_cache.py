@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+import hashlib
+import os
+import time
+
+# Number of leading index pages served from the cache, and how long an entry may be served
+# after it was rendered. report_bribe invalidates this worker's entries as soon as a report is
+# committed, the TTL bounds how long other workers keep serving the page without the new report.
+PAGE_CACHE_PAGES = int(os.environ.get("page_cache_pages", "3"))
+PAGE_CACHE_TTL = float(os.environ.get("page_cache_ttl", "30"))
+
+@dataclass
+class CachedPage:
+    body: bytes
+    etag: str
+    expires_at: float
+
+# Rendered index output keyed on (page, variant). Anonymous visitors all see the same page so the
+# whole response body is kept, signed-in visitors get a per-user header so only the leaderboard
+# fragment is kept and the header is rendered around it.
+class PageCache:
+    def __init__(self, pages: int = PAGE_CACHE_PAGES, ttl: float = PAGE_CACHE_TTL):
+        self.pages = pages
+        self.ttl = ttl
+        self.generation = 0
+        self._entries: dict[tuple[int, str], CachedPage] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def cacheable(self, page: int, cursor: str | None) -> bool:
+        return self.ttl > 0 and cursor is None and page <= self.pages
+
+    def get(self, page: int, variant: str) -> CachedPage | None:
+        entry = self._entries.get((page, variant))
+        if entry is None or entry.expires_at <= time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    # generation is the value read before the page was queried, a render that raced with an
+    # invalidation is returned to its request but not stored
+    def put(self, page: int, variant: str, body: bytes, generation: int) -> CachedPage:
+        entry = CachedPage(body=body, etag=etag_for(body), expires_at=time.monotonic() + self.ttl)
+        if generation == self.generation:
+            self._entries[(page, variant)] = entry
+        return entry
+
+    def invalidate(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "generation": self.generation, "hits": self.hits, "misses": self.misses}
+
+# Weak validator derived from the content, so every worker hands out the same ETag for the same page
+def etag_for(body: bytes) -> str:
+    return f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # weak comparison, W/"x" and "x" name the same representation
+    return "*" in candidates or etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in candidates)
+
+page_cache = PageCache()
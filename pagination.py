@@ -0,0 +1,37 @@
+import base64
+import binascii
+import os
+
+PAGE_SIZE = 50
+
+# ?page= links are served with OFFSET only up to this page, deeper pages must use the after/before cursors
+MAX_OFFSET_PAGES = int(os.environ.get("max_offset_pages", "5"))
+
+class InvalidCursor(ValueError):
+    pass
+
+# Cursors are opaque to clients: base64url of "<sort key>:<bribe_id>" for the boundary row
+def _pack(key, bribe_id: str) -> str:
+    raw = f"{key}:{bribe_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _unpack(token: str, key_type: type) -> tuple:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        key, bribe_id = base64.urlsafe_b64decode(padded).decode().split(":", 1)
+        return key_type(key), bribe_id
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor(token) from e
+
+def encode_cursor(bribe_amt: int, bribe_id: str) -> str:
+    return _pack(bribe_amt, bribe_id)
+
+def decode_cursor(token: str) -> tuple[int, str]:
+    return _unpack(token, int)
+
+# Search results are ordered by rank, repr() keeps the float exact so the next page starts right after it
+def encode_rank_cursor(rank: float, bribe_id: str) -> str:
+    return _pack(repr(rank), bribe_id)
+
+def decode_rank_cursor(token: str) -> tuple[float, str]:
+    return _unpack(token, float)
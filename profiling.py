@@ -0,0 +1,165 @@
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+import asyncio
+import os
+import sys
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this are logged with their parameter types and plan, 0 turns the log off
+SLOW_QUERY_MS = float(os.environ.get("slow_query_ms", "0"))
+# The same statement is EXPLAINed at most once per interval, so a slow hot query doesn't double the load
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get("slow_query_explain_interval", "300"))
+EXPLAINABLE = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+# Only these Supabase user ids may profile a request. Ids rather than usernames because
+# user_metadata can be edited by the user.
+PROFILE_ADMIN_IDS = {user_id.strip() for user_id in os.environ.get("profile_admin_ids", "").split(",") if user_id.strip()}
+PROFILE_INTERVAL_MS = float(os.environ.get("profile_interval_ms", "5"))
+
+def _parameter_shape(parameters) -> str:
+    # types only, the values can be personal data
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+class SlowQueryLog:
+    def __init__(self, engine: AsyncEngine, threshold_ms: float = SLOW_QUERY_MS,
+                 explain_interval: float = SLOW_QUERY_EXPLAIN_INTERVAL):
+        self.engine = engine
+        self.threshold = threshold_ms / 1000
+        self.explain_interval = explain_interval
+        # statement -> last EXPLAIN time, oldest first. Entries older than the interval no longer
+        # hold anything back, so they are dropped and the dict only grows with the slow statements
+        # seen in one interval.
+        self._explained: OrderedDict[str, float] = OrderedDict()
+        self._tasks: set[asyncio.Task] = set()
+
+    def install(self) -> None:
+        sync_engine = self.engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", self._before)
+        event.listen(sync_engine, "after_cursor_execute", self._after)
+        event.listen(sync_engine, "handle_error", self._on_error)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+    def _on_error(self, exception_context):
+        starts = exception_context.connection.info.get("slow_query_start") if exception_context.connection else None
+        if starts:
+            starts.pop()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["slow_query_start"].pop()
+        if elapsed < self.threshold or conn.info.get("slow_query_explaining"):
+            return
+        logger.warning("Slow query (%.1f ms, params %s): %s", elapsed * 1000, _parameter_shape(parameters), statement)
+        if executemany or statement.lstrip().split(None, 1)[0].upper() not in EXPLAINABLE:
+            return
+        now = time.monotonic()
+        while self._explained and now - next(iter(self._explained.values())) >= self.explain_interval:
+            self._explained.popitem(last=False)
+        if statement in self._explained:
+            return
+        self._explained[statement] = now
+        # On its own connection: a failing EXPLAIN must not abort the request's transaction
+        task = asyncio.get_running_loop().create_task(self._explain(statement, parameters, elapsed))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _explain(self, statement: str, parameters, elapsed: float) -> None:
+        try:
+            async with self.engine.connect() as conn:
+                info = conn.info
+                info["slow_query_explaining"] = True
+                try:
+                    # plain EXPLAIN only plans the statement, writes are not executed
+                    rows = (await conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)).all()
+                finally:
+                    info.pop("slow_query_explaining", None)
+            plan = "\n".join(" ".join(str(value) for value in row) for row in rows)
+            logger.warning("Plan for slow query (%.1f ms): %s\n%s", elapsed * 1000, statement, plan)
+        except Exception as e:
+            logger.error("EXPLAIN of slow query failed: %s", e)
+
+# Samples the stack of one thread (the event loop) at a fixed interval and counts identical stacks.
+# Every coroutine running on the loop is sampled, so concurrent requests show up in the profile too.
+class StackSampler:
+    def __init__(self, thread_id: int, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+# "root;caller;callee count" per line, the input format of flamegraph.pl and speedscope
+def folded_stacks(stacks: Counter) -> str:
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+def profile_requested(scope) -> bool:
+    if any(name == b"x-profile" and value == b"1" for name, value in scope["headers"]):
+        return True
+    return b"_profile=1" in scope.get("query_string", b"").split(b"&")
+
+# With X-Profile: 1 or ?_profile=1 from an admin, runs the request under the stack sampler and
+# answers with the folded stacks instead of the page. The original status is in X-Profiled-Status.
+# Needs the session, so it has to sit inside SessionMiddleware.
+class ProfilingMiddleware:
+    def __init__(self, app, current_user_id: Callable[[Request], Awaitable[str | None]]):
+        self.app = app
+        self.current_user_id = current_user_id
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILE_ADMIN_IDS or not profile_requested(scope):
+            await self.app(scope, receive, send)
+            return
+        user_id = await self.current_user_id(Request(scope))
+        if user_id is None or str(user_id) not in PROFILE_ADMIN_IDS:
+            logger.warning("Profiling requested for %s by non-admin user %s", scope["path"], user_id)
+            await self.app(scope, receive, send)
+            return
+
+        status = None
+        async def discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        sampler = StackSampler(threading.get_ident())
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            stacks = sampler.stop()
+        elapsed = time.perf_counter() - start
+        logger.info("Profiled %s %s in %.1f ms, %s samples", scope["method"], scope["path"], elapsed * 1000, sum(stacks.values()))
+        response = PlainTextResponse(folded_stacks(stacks), headers={"X-Profiled-Status": str(status)})
+        await response(scope, receive, send)
@@ -0,0 +1,172 @@
+from dataclasses import dataclass
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import inspect, tuple_, func, literal_column
+from sqlalchemy.orm import joinedload
+from sqlalchemy.engine import Row
+from sqlalchemy.sql.elements import ColumnElement
+import datetime
+from .models import Bribe, User
+from .pagination import PAGE_SIZE
+from .ids import is_well_formed
+from .users import user_directory
+
+# Columns the leaderboard renders. Listing pages select only these, so descr (up to 3000 chars)
+# and evidence_urls are never sent over the wire and no ORM objects are built for them.
+LISTING_COLUMNS = (
+    Bribe.ofcl_name,
+    Bribe.dept,
+    Bribe.state_ut,
+    Bribe.district,
+    Bribe.bribe_amt,
+    Bribe.doi,
+    Bribe.bribe_id,
+)
+
+# Optional filters of the report listing. Used as a FastAPI dependency (Depends()), so every field
+# is a query parameter. Equality filters on state, state and district, or dept line up with the
+# (..., bribe_amt, bribe_id) indexes, so filtered pages are still read in cursor order. Other
+# combinations (e.g. district without state) fall back to filtering the leaderboard index.
+@dataclass
+class ListingFilters:
+    state: str | None = None
+    district: str | None = None
+    dept: str | None = None
+    date_from: datetime.date | None = None
+    date_to: datetime.date | None = None
+    min_amount: int | None = None
+    max_amount: int | None = None
+
+    def conditions(self) -> list[ColumnElement[bool]]:
+        conditions = []
+        if self.state:
+            conditions.append(Bribe.state_ut == self.state)
+        if self.district:
+            conditions.append(Bribe.district == self.district)
+        if self.dept:
+            conditions.append(Bribe.dept == self.dept)
+        if self.date_from:
+            conditions.append(Bribe.doi >= self.date_from)
+        if self.date_to:
+            conditions.append(Bribe.doi <= self.date_to)
+        if self.min_amount is not None:
+            conditions.append(Bribe.bribe_amt >= self.min_amount)
+        if self.max_amount is not None:
+            conditions.append(Bribe.bribe_amt <= self.max_amount)
+        return conditions
+
+    def query_params(self) -> dict:
+        return {name: value for name, value in vars(self).items() if value is not None and value != ""}
+
+# One page of the leaderboard as lightweight rows (tuples with attribute access). after/before are
+# (bribe_amt, bribe_id) keyset cursors, without either the page is read with OFFSET.
+# Returns the rows in display order and whether more rows exist in the direction walked.
+async def listing_page(session: AsyncSession, page: int = 1, after: tuple[int, str] | None = None,
+                 before: tuple[int, str] | None = None, filters: ListingFilters | None = None) -> tuple[list[Row], bool]:
+    key = tuple_(Bribe.bribe_amt, Bribe.bribe_id)
+    if before:
+        # Walk backwards from the cursor in ascending order and flip the rows afterwards
+        query = select(*LISTING_COLUMNS).where(key > tuple_(*before)).order_by(Bribe.bribe_amt.asc(), Bribe.bribe_id.asc())
+    else:
+        # bribe_id breaks ties between equal amounts so every row has a stable position
+        query = select(*LISTING_COLUMNS).order_by(Bribe.bribe_amt.desc(), Bribe.bribe_id.desc())
+        if after:
+            query = query.where(key < tuple_(*after))
+        else:
+            query = query.offset((page - 1) * PAGE_SIZE)
+    if filters:
+        query = query.where(*filters.conditions())
+
+    # Fetch one extra row to know whether there is anything past this page
+    rows = list((await session.exec(query.limit(PAGE_SIZE + 1))).all())
+    has_more = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+    if before:
+        rows.reverse()
+    return rows, has_more
+
+# Text search configuration of the descr_tsv column, has to match the migration that generates it
+SEARCH_CONFIG = literal_column("'english'::regconfig")
+# Generated by Postgres and only read here, so it is not part of the Bribe model. It is added by
+# migration 9c4f2e7a1b36, a database built by create_all alone doesn't have it.
+DESCR_TSV = literal_column("bribe.descr_tsv")
+
+_search_available = False
+
+def _has_descr_tsv(connection) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    return any(column["name"] == "descr_tsv" for column in inspect(connection).get_columns("bribe"))
+
+# Whether search_reports can run on this database. Only a positive answer is kept, so the
+# migration can be applied without restarting the workers.
+async def search_available(session: AsyncSession) -> bool:
+    global _search_available
+    if not _search_available:
+        connection = await session.connection()
+        _search_available = await connection.run_sync(_has_descr_tsv)
+    return _search_available
+
+# One page of reports matching a web-search style query ("rto licence", "police -traffic"),
+# best ranked first. The GIN index on descr_tsv finds the matches; every match is still ranked to
+# order them, the keyset cursor (rank, bribe_id) only saves re-reading the earlier pages.
+async def search_reports(session: AsyncSession, text: str, after: tuple[float, str] | None = None) -> tuple[list[Row], bool]:
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, text)
+    rank = func.ts_rank_cd(DESCR_TSV, tsquery)
+    query = (
+        select(*LISTING_COLUMNS, rank.label("rank"),
+               func.ts_headline(SEARCH_CONFIG, Bribe.descr, tsquery, "MaxFragments=2").label("snippet"))
+        .where(DESCR_TSV.op("@@")(tsquery))
+        .order_by(rank.desc(), Bribe.bribe_id.desc())
+    )
+    if after:
+        query = query.where(tuple_(rank, Bribe.bribe_id) < tuple_(*after))
+    rows = list((await session.exec(query.limit(PAGE_SIZE + 1))).all())
+    return rows[:PAGE_SIZE], len(rows) > PAGE_SIZE
+
+# Columns of a tracked report for the JSON API, the reporter's username comes from a join
+TRACK_COLUMNS = (
+    Bribe.bribe_id,
+    User.username,
+    Bribe.ofcl_name,
+    Bribe.dept,
+    Bribe.bribe_amt,
+    Bribe.state_ut,
+    Bribe.district,
+    Bribe.descr,
+    Bribe.doi,
+    Bribe.evidence_urls,
+    Bribe.evidence_status,
+)
+
+# Applies the track filters to query, which selects either Bribe objects or TRACK_COLUMNS rows
+async def _tracked(session: AsyncSession, query, username: str | None, reporting_id: str | None) -> list:
+    if reporting_id and not is_well_formed(reporting_id):
+        # mistyped reporting id, its check character already tells us there is nothing to find
+        return []
+    if username:
+        user_id = await user_directory.resolve(session, username)
+        if user_id is None:
+            return []
+        query = query.where(Bribe.id == user_id)
+        if reporting_id:
+            # The requested report sorts first, then the user's other reports by amount
+            query = query.order_by((Bribe.bribe_id == reporting_id).desc(), Bribe.bribe_amt.desc())
+            bribes = list((await session.exec(query)).all())
+            if not bribes or bribes[0].bribe_id != reporting_id:
+                return []
+            return bribes
+        return list((await session.exec(query)).all())
+    if reporting_id:
+        return list((await session.exec(query.where(Bribe.bribe_id == reporting_id))).all())
+    return []
+
+# Reports shown on the track page. The username is resolved to an id through the user directory
+# (usually without a query) and Bribe.user is joined in, so building the response never lazy loads a user per row.
+async def track_reports(session: AsyncSession, username: str | None = None, reporting_id: str | None = None) -> list[Bribe]:
+    return await _tracked(session, select(Bribe).options(joinedload(Bribe.user)), username, reporting_id)
+
+# The same reports as plain TRACK_COLUMNS rows, no ORM objects are built
+async def track_rows(session: AsyncSession, username: str | None = None, reporting_id: str | None = None) -> list[Row]:
+    query = select(*TRACK_COLUMNS).join(User, Bribe.id == User.id)
+    return await _tracked(session, query, username, reporting_id)
@@ -0,0 +1,134 @@
+from dataclasses import dataclass
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .db import async_session
+from .models import Bribe, BribeStat
+import argparse
+import asyncio
+import datetime
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_MONTH = "unknown"
+
+# Dimensions the stats API can group by
+GROUPINGS = {
+    "state": BribeStat.state_ut,
+    "district": BribeStat.district,
+    "dept": BribeStat.dept,
+    "month": BribeStat.month,
+}
+
+def month_of(doi: datetime.date | None) -> str:
+    return doi.strftime("%Y-%m") if doi else UNKNOWN_MONTH
+
+# Upsert constructs per dialect, with the function that returns the larger of two values.
+# SQLite's two-argument max() is a scalar function, Postgres spells it greatest().
+UPSERT_DIALECTS = {
+    "postgresql": (postgresql.insert, func.greatest),
+    "sqlite": (sqlite.insert, func.max),
+}
+
+# Adds one report to its rollup row. Runs in report_bribe's transaction, so the row and the report
+# are committed (or rolled back) together. Databases without an upsert here are left to the rebuild.
+async def record_report(session: AsyncSession, bribe: Bribe) -> None:
+    dialect = session.get_bind().dialect.name
+    if dialect not in UPSERT_DIALECTS:
+        return
+    dialect_insert, larger = UPSERT_DIALECTS[dialect]
+    stmt = dialect_insert(BribeStat).values(
+        state_ut=bribe.state_ut,
+        district=bribe.district,
+        dept=bribe.dept,
+        month=month_of(bribe.doi),
+        report_count=1,
+        amount_total=bribe.bribe_amt,
+        amount_max=bribe.bribe_amt,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[BribeStat.state_ut, BribeStat.district, BribeStat.dept, BribeStat.month],
+        set_={
+            "report_count": BribeStat.report_count + 1,
+            "amount_total": BribeStat.amount_total + stmt.excluded.amount_total,
+            "amount_max": larger(BribeStat.amount_max, stmt.excluded.amount_max),
+        },
+    )
+    await session.execute(stmt)
+
+# Recomputes every rollup row from the bribe table in one transaction. The EXCLUSIVE lock makes
+# concurrent report_bribe upserts wait until the rebuild commits: reports committed before the
+# lock are counted by the rebuild's SELECT, the waiting ones add themselves afterwards. Readers
+# are not blocked.
+async def rebuild(session: AsyncSession) -> int:
+    await session.execute(text(f"LOCK TABLE {BribeStat.__tablename__} IN EXCLUSIVE MODE"))
+    await session.execute(delete(BribeStat))
+    month = func.coalesce(func.to_char(Bribe.doi, "YYYY-MM"), UNKNOWN_MONTH)
+    source = (
+        select(Bribe.state_ut, Bribe.district, Bribe.dept, month,
+               func.count(), func.sum(Bribe.bribe_amt), func.max(Bribe.bribe_amt))
+        .group_by(Bribe.state_ut, Bribe.district, Bribe.dept, month)
+    )
+    result = await session.execute(insert(BribeStat).from_select(
+        ["state_ut", "district", "dept", "month", "report_count", "amount_total", "amount_max"], source
+    ))
+    await session.commit()
+    return result.rowcount
+
+# Filters of the stats API, used as a FastAPI dependency like queries.ListingFilters.
+# month_from / month_to are "YYYY-MM" and leave out reports without a date of incident.
+@dataclass
+class StatsFilters:
+    state: str | None = None
+    district: str | None = None
+    dept: str | None = None
+    month_from: str | None = None
+    month_to: str | None = None
+
+    def conditions(self) -> list:
+        conditions = []
+        if self.state:
+            conditions.append(BribeStat.state_ut == self.state)
+        if self.district:
+            conditions.append(BribeStat.district == self.district)
+        if self.dept:
+            conditions.append(BribeStat.dept == self.dept)
+        if self.month_from or self.month_to:
+            conditions.append(BribeStat.month != UNKNOWN_MONTH)
+        if self.month_from:
+            conditions.append(BribeStat.month >= self.month_from)
+        if self.month_to:
+            conditions.append(BribeStat.month <= self.month_to)
+        return conditions
+
+# Totals per value of one dimension, largest total amount first. Reads only the rollup table, whose
+# size depends on the number of distinct (state, district, dept, month) combinations, not on the
+# number of reports.
+async def group_totals(session: AsyncSession, by: str, filters: StatsFilters) -> list[dict]:
+    key = GROUPINGS[by]
+    amount_total = func.sum(BribeStat.amount_total)
+    query = (
+        select(key, func.sum(BribeStat.report_count), amount_total, func.max(BribeStat.amount_max))
+        .where(*filters.conditions())
+        .group_by(key)
+        .order_by(amount_total.desc(), key)
+    )
+    rows = (await session.execute(query)).all()
+    return [
+        {"key": value, "reports": int(reports), "amount_total": int(total), "amount_max": amount_max}
+        for value, reports, total, amount_max in rows
+    ]
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain the bribe statistics rollup table")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+    start = time.monotonic()
+    async with async_session() as session:
+        groups = await rebuild(session)
+    print(f"Rebuilt {groups} rollup rows in {time.monotonic() - start:.1f}s")
+
+if __name__ == "__main__":
+    asyncio.run(main())
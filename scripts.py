@@ -1,127 +1,208 @@
+# Bulk loader for the bribe table, for seeding and load testing.
+#
+#   python -m package.scripts generate --rows 10000000 --workers 8
+#   python -m package.scripts csv reports.csv
+#   python -m package.scripts jsonl reports.jsonl
+#
+# Rows are written in batches with COPY FROM STDIN, one round trip and one commit per batch.
+# Generated rows are built by a pool of worker processes (Faker is the bottleneck) while the main
+# process copies finished batches into the database. Reports are attributed to random existing
+# users, so at least one row must exist in the user table.
 from faker import Faker
-import psycopg2
-import uuid
-import random
+from datetime import date, timedelta
+from .ids import BribeIdGenerator
+import argparse
+import collections
+import csv
+import io
+import json
+import multiprocessing
 import os
+import random
+import sys
 import time
-from datetime import datetime, timedelta
-from supabase import create_client, Client
-
-
-url: str = os.environ.get("supabase_url")
-key: str = os.environ.get("supabase_key")
-supabase: Client = create_client(url, key)
-
-# Initialize Faker with Indian locale for relevant data
-fake = Faker('en_IN')
-
-# Connect to PostgreSQL
-conn = psycopg2.connect(os.environ.get("db_url"))
-cursor = conn.cursor()
+import psycopg2
 
-print("CHECK 1")
+COLUMNS = ("ofcl_name", "dept", "bribe_amt", "pin_code", "state_ut", "district",
+           "descr", "doi", "evidence_urls", "bribe_id", "id")
+COPY_SQL = f"COPY bribe ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+# NOT NULL columns without a default, every input record needs a value for them. A missing bribe_id
+# is generated from the reporting user's username, the same way report_bribe does it.
+REQUIRED_COLUMNS = ("dept", "bribe_amt", "state_ut", "district", "descr", "id")
+# Finished batches waiting for COPY, per worker. Caps memory when COPY is slower than the workers.
+BATCHES_IN_FLIGHT_PER_WORKER = 2
 
 # Generate mock dept
 departments = [
-    "Police", "Municipal Corporation", "Transport", 
+    "Police", "Municipal Corporation", "Transport",
     "Electricity Board", "Tax Department", "Education"
 ]
 
 indian_states_ut = [
-    "Andhra Pradesh", "Arunachal Pradesh", "Assam", "Bihar", 
-    "Chhattisgarh", "Goa", "Gujarat", "Haryana", 
-    "Himachal Pradesh", "Jharkhand", "Karnataka", 
+    "Andhra Pradesh", "Arunachal Pradesh", "Assam", "Bihar",
+    "Chhattisgarh", "Goa", "Gujarat", "Haryana",
+    "Himachal Pradesh", "Jharkhand", "Karnataka",
     "Kerala", "Madhya Pradesh", "Maharashtra", "Manipur",
-    "Meghalaya", "Mizoram", "Nagaland", "Odisha", 
-    "Punjab", "Rajasthan", "Sikkim", "Tamil Nadu", 
-    "Telangana", "Tripura", "Uttar Pradesh", "Uttarakhand", 
-    "West Bengal", "Andaman and Nicobar Islands", 
+    "Meghalaya", "Mizoram", "Nagaland", "Odisha",
+    "Punjab", "Rajasthan", "Sikkim", "Tamil Nadu",
+    "Telangana", "Tripura", "Uttar Pradesh", "Uttarakhand",
+    "West Bengal", "Andaman and Nicobar Islands",
     "Chandigarh", "Dadra and Nagar Haveli and Daman and Diu",
     "Lakshadweep", "Delhi", "Puducherry"
 ]
 
-'''
-# Create 50 mock users
-users = {}
-for i in range(50):
-    if i==9 or i== 19 or i==29 or i==39:
-        time.sleep(3)
-    username = fake.user_name() + str(random.randint(100, 999))  # Ensure unique username
-    email= fake.email()
-    password = fake.password(lower_case=True, digits=True)
-    users[i]= {"email": email,"password": password,}
-    response1=supabase.auth.sign_up(
-              {
-                "email": email,
-                "password": password
-              }
-            ) 
-    response2=supabase.table("user").insert({"username": username, "id": response1.user.id}).execute()
-    #user_ids.append((response1.user.id,))
-
-print("CHECK 2")  '''
-
-# Insert users and get their IDs
-#cursor.executemany("INSERT INTO \"user\" (username) VALUES (%s)", users)
-#conn.commit()
-
-
-# Get all user IDs
-user_ids=[]
-cursor.execute("SELECT id FROM \"user\"")
-user_ids = [row[0] for row in cursor.fetchall()]
-
-print("CHECK 3")
-
-# Generate 200 mock bribes
-bribes = []
-for _ in range(200):
-
-    ''' key=random.choice(list(users.keys()))
-    email=users[key]["email"]
-    password=users[key]["password"]
-
-    response1=supabase.auth.sign_in_with_password(
-            {
-                "email": email,
-                "password": password
-            }
-        ) '''
-    user_id = random.choice(user_ids)
-    department = random.choice(departments)
-    state = random.choice(indian_states_ut)
-    
-    bribe = (
-        #str(uuid.uuid4()),  # Generate UUID
-        fake.name(),        # Official name
-        department,
-        random.randint(500, 50000),  # Bribe amount
-        random.randint(100000, 999999),  # Pincode - generates a 6-digit random number
-        state,
-        fake.city(),        # District
-        fake.text(max_nb_chars=300),  # Description
-        (datetime.now() - timedelta(days=random.randint(0, 365))).date(),  # Date of incident
-        None,               # Evidence (bytes) - can be null
-        str(uuid.uuid4())[:6], # bribe_id - first 8 chars of UUID
-        user_id
-    )
-    bribes.append(bribe)
-    #response2 = supabase.auth.sign_out()
-
-print("CHECK 4")
-
-# Insert bribes
-cursor.executemany("""
-    INSERT INTO bribe (
-        ofcl_name, dept, bribe_amt, pin_code, 
-        state_ut, district, descr, doi, evidence_urls, bribe_id, id
-    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s,%s, %s)
-""", bribes)
-
-print("CHECK 5")
-
-conn.commit()
-cursor.close()
-conn.close()
-
-print("DONE!")
\ No newline at end of file
+# Per worker process state, set up once by _init_worker
+_fake: Faker | None = None
+_ids: BribeIdGenerator | None = None
+_users: list[tuple[str, str]] = []
+
+def _init_worker(worker_numbers, users: list[tuple[str, str]], seed: int | None) -> None:
+    global _fake, _ids, _users
+    with worker_numbers.get_lock():
+        number = worker_numbers.value
+        worker_numbers.value += 1
+    # Initialize Faker with Indian locale for relevant data
+    _fake = Faker('en_IN')
+    if seed is not None:
+        _fake.seed_instance(seed + number)
+        random.seed(seed + number)
+    # a distinct node per worker keeps the generated bribe_ids unique across processes
+    _ids = BribeIdGenerator(node=number)
+    _users = users
+
+# One batch of generated reports as CSV text, ready for COPY
+def _generate_batch(size: int) -> tuple[str, int]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    today = date.today()
+    for _ in range(size):
+        user_id, username = random.choice(_users)
+        writer.writerow((
+            _fake.name(),        # Official name
+            random.choice(departments),
+            random.randint(500, 50000),  # Bribe amount
+            str(random.randint(100000, 999999)),  # Pincode - a 6-digit random number
+            random.choice(indian_states_ut),
+            _fake.city(),        # District
+            _fake.text(max_nb_chars=300),  # Description
+            today - timedelta(days=random.randint(0, 365)),  # Date of incident
+            "[]",                # no evidence
+            _ids.new_id(username),
+            user_id,
+        ))
+    return buffer.getvalue(), size
+
+def _generated_batches(rows: int, batch_size: int, workers: int, users: list[tuple[str, str]], seed: int | None):
+    sizes = [batch_size] * (rows // batch_size) + ([rows % batch_size] if rows % batch_size else [])
+    worker_numbers = multiprocessing.Value("i", 0)
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(worker_numbers, users, seed)) as pool:
+        # A new batch is only submitted once an earlier one has been taken for COPY, so at most
+        # this many batches are generated ahead of the database
+        in_flight = collections.deque()
+        for size in sizes:
+            if len(in_flight) >= workers * BATCHES_IN_FLIGHT_PER_WORKER:
+                yield in_flight.popleft().get()
+            in_flight.append(pool.apply_async(_generate_batch, (size,)))
+        while in_flight:
+            yield in_flight.popleft().get()
+
+# CSV input needs a header naming the columns (any subset of COLUMNS that includes REQUIRED_COLUMNS,
+# in any order), JSONL input one object per line with the same keys. Other missing or empty values
+# are loaded as NULL. Invalid input raises ValueError before the batch holding it is copied.
+def _file_records(path: str, fmt: str):
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+            if missing:
+                raise ValueError(f"CSV header has no {', '.join(missing)} column")
+            yield from reader
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def _file_batches(path: str, fmt: str, batch_size: int, usernames: dict[str, str]):
+    ids = BribeIdGenerator()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for number, record in enumerate(_file_records(path, fmt), 1):
+        missing = [column for column in REQUIRED_COLUMNS if record.get(column) in (None, "")]
+        if missing:
+            raise ValueError(f"record {number} has no {', '.join(missing)}")
+        if not record.get("bribe_id"):
+            username = usernames.get(str(record["id"]))
+            if username is None:
+                raise ValueError(f"record {number} belongs to unknown user {record['id']}")
+            record = {**record, "bribe_id": ids.new_id(username)}
+        values = []
+        for column in COLUMNS:
+            value = record.get(column)
+            if column == "evidence_urls" and not isinstance(value, str):
+                value = json.dumps(value or [])
+            values.append(None if value == "" else value)
+        writer.writerow(values)
+        count += 1
+        if count == batch_size:
+            yield buffer.getvalue(), count
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            count = 0
+    if count:
+        yield buffer.getvalue(), count
+
+def _copy_batches(conn, batches) -> int:
+    loaded = 0
+    start = last_report = time.monotonic()
+    with conn.cursor() as cursor:
+        for data, count in batches:
+            cursor.copy_expert(COPY_SQL, io.StringIO(data))
+            conn.commit()
+            loaded += count
+            now = time.monotonic()
+            if now - last_report >= 1:
+                print(f"{loaded:,} rows, {loaded / (now - start):,.0f} rows/s", file=sys.stderr)
+                last_report = now
+    elapsed = time.monotonic() - start
+    print(f"Loaded {loaded:,} rows in {elapsed:.1f}s ({loaded / elapsed if elapsed else 0:,.0f} rows/s)", file=sys.stderr)
+    return loaded
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk load bribe reports with COPY")
+    parser.add_argument("source", choices=["generate", "csv", "jsonl"])
+    parser.add_argument("path", nargs="?", help="input file for csv and jsonl")
+    parser.add_argument("--rows", type=int, default=200, help="rows to generate")
+    parser.add_argument("--batch-size", type=int, default=50_000, help="rows per COPY and commit")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="generator processes")
+    parser.add_argument("--seed", type=int, default=None, help="make generated data reproducible")
+    args = parser.parse_args()
+    if args.source != "generate" and not args.path:
+        parser.error(f"{args.source} needs an input file")
+    if not 1 <= args.workers <= 256:
+        parser.error("--workers must be between 1 and 256") # one bribe_id node per worker
+
+    # Connect to PostgreSQL
+    conn = psycopg2.connect(os.environ.get("db_url"))
+    try:
+        with conn.cursor() as cursor:
+            # a crash loses at most the last few batches, which a load run can simply repeat
+            cursor.execute("SET synchronous_commit = off")
+            cursor.execute("SELECT id, username FROM \"user\"")
+            users = [(str(user_id), username) for user_id, username in cursor.fetchall()]
+        if args.source == "generate":
+            if not users:
+                sys.exit("No users to attribute reports to, sign up at least one user first")
+            batches = _generated_batches(args.rows, args.batch_size, args.workers, users, args.seed)
+        else:
+            batches = _file_batches(args.path, args.source, args.batch_size, dict(users))
+        try:
+            _copy_batches(conn, batches)
+        except ValueError as e:
+            sys.exit(f"{args.path}: {e}")
+    finally:
+        conn.close()
+    print("Rollup totals are not updated by the loader, run `python -m package.rollups rebuild` next", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+from dataclasses import dataclass, field
+from gotrue import AsyncGoTrueClient
+from postgrest import AsyncQueryRequestBuilder
+from storage3._async.file_api import AsyncBucketProxy
+from supabase import AsyncClient
+
+# The app keeps one shared Supabase client per worker. Anything that depends on who the user is goes
+# through the scoped helpers below instead of set_session() on the shared client, so concurrent
+# requests never overwrite each other's auth state. Both reuse the shared client's HTTP connection pool.
+
+# Auth client for a single request: session kept in its own memory, no background token refresh
+def scoped_auth(supabase: AsyncClient) -> AsyncGoTrueClient:
+    return AsyncGoTrueClient(
+        url=supabase.auth._url,
+        headers=supabase.auth._headers,
+        http_client=supabase.auth._http_client,
+        auto_refresh_token=False,
+        persist_session=False,
+    )
+
+# Storage bucket that sends the user's access token with every call, so storage policies see the user
+@dataclass
+class ScopedBucket(AsyncBucketProxy):
+    access_token: str = field(default="", repr=False)
+
+    async def _request(self, method, url, headers=None, **kwargs):
+        headers = {**(headers or {}), "Authorization": f"Bearer {self.access_token}"}
+        return await super()._request(method, url, headers=headers, **kwargs)
+
+def scoped_bucket(supabase: AsyncClient, bucket_name: str, access_token: str) -> ScopedBucket:
+    return ScopedBucket(bucket_name, supabase.storage.session, access_token)
+
+# Table query sent with the user's access token instead of the key the shared client holds, so row
+# level security policies see the user. Only this request's headers change, not the shared session's.
+def scoped_query(query: AsyncQueryRequestBuilder, access_token: str) -> AsyncQueryRequestBuilder:
+    query.headers["Authorization"] = f"Bearer {access_token}"
+    return query
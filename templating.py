@@ -0,0 +1,61 @@
+from fastapi.responses import StreamingResponse
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+from typing import AsyncIterator
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = "templates"
+# Compiled templates are kept here between restarts so a fresh worker doesn't recompile every
+# template on its first requests. Set template_cache_dir to an empty string to compile in memory only.
+TEMPLATE_CACHE_DIR = os.environ.get("template_cache_dir", ".jinja_cache")
+# Rendered output is sent in chunks of at least this many characters instead of one send per text node
+TEMPLATE_STREAM_CHUNK = int(os.environ.get("template_stream_chunk", "16384"))
+
+def _bytecode_cache(pattern: str) -> FileSystemBytecodeCache | None:
+    if not TEMPLATE_CACHE_DIR:
+        return None
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    return FileSystemBytecodeCache(TEMPLATE_CACHE_DIR, pattern)
+
+# Sync and async environments compile the same source to different code, so they must not share cache files
+templates = Jinja2Templates(env=Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=True,
+    bytecode_cache=_bytecode_cache("__jinja2_%s.cache"),
+))
+stream_templates = Jinja2Templates(env=Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=True,
+    enable_async=True,
+    bytecode_cache=_bytecode_cache("__jinja2_async_%s.cache"),
+))
+
+# Compiles every template up front (or loads it from the bytecode cache) so no request pays for it
+def warm_templates() -> None:
+    for jinja_templates in (templates, stream_templates):
+        env = jinja_templates.env
+        for name in env.list_templates(extensions=["html"]):
+            env.get_template(name)
+    logger.info("Template cache warmed from %s", TEMPLATE_DIR)
+
+async def _chunked(parts: AsyncIterator[str], size: int) -> AsyncIterator[str]:
+    buffer = []
+    length = 0
+    async for part in parts:
+        buffer.append(part)
+        length += len(part)
+        if length >= size:
+            yield "".join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield "".join(buffer)
+
+# Renders the template while sending it, the head of a large page reaches the client before the
+# last rows are rendered and the event loop is released between chunks
+def stream_template(name: str, context: dict, status_code: int = 200) -> StreamingResponse:
+    parts = stream_templates.get_template(name).generate_async(context)
+    return StreamingResponse(_chunked(parts, TEMPLATE_STREAM_CHUNK), status_code=status_code, media_type="text/html")
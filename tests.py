@@ -3,6 +3,26 @@ from fastapi.testclient import TestClient
 from .main import app
 from .main import engine, SQLModel, Session
 from .main import User, Bribe # Import your User and Bribe models
+from .main import get_current_user
+from .models import BribeStat
+from .pagination import encode_cursor, decode_cursor, InvalidCursor, PAGE_SIZE
+from .auth import TokenCache, VerifiedUser
+from .ids import BribeIdGenerator, is_well_formed
+from .metrics import render_metrics
+from . import metrics
+from .db import is_duplicate_key
+from .evidence import accepted_evidence, EvidenceTooLarge
+from starlette.datastructures import UploadFile, Headers
+from sqlalchemy.exc import IntegrityError
+from . import main
+from postgrest import AsyncPostgrestClient
+from types import SimpleNamespace
+import csv
+import httpx
+import io
+import json
+import time
+import uuid
 import pytest
 import datetime
 
@@ -59,6 +79,253 @@ def test_index_route():
     # Assert that the response is HTML (you can check for specific content if needed)
     assert response.template.name == "base.html"
 
+# Test that the keyset pagination cursor round trips and rejects garbage
+def test_pagination_cursor():
+    cursor = encode_cursor(50000, "abcd123456")
+    assert decode_cursor(cursor) == (50000, "abcd123456")
+    with pytest.raises(InvalidCursor):
+        decode_cursor("not-a-cursor")
+
+# Test that deep ?page= links are redirected instead of running a deep OFFSET
+def test_index_deep_page_redirect():
+    response = client.get("/?page=100000", follow_redirects=False)
+    assert response.status_code == 303
+    assert response.headers['location'].startswith("/?page=")
+
+# Test that the verified token cache is bounded and drops expired tokens
+def test_token_cache():
+    cache = TokenCache(maxsize=2)
+    user = VerifiedUser({"sub": "user-1", "user_metadata": {"username": "tester"}})
+    cache.put("token-1", user, time.time() + 60)
+    cache.put("token-2", user, time.time() - 1)
+    cache.put("token-3", user, time.time() + 60)
+    assert cache.get("token-1") is None # evicted, least recently used
+    assert cache.get("token-2") is None
+    assert cache.get("token-3").user_metadata["username"] == "tester"
+
+# Test that generated reporting ids are unique, ordered and carry a working check character
+def test_bribe_id_generator():
+    generator = BribeIdGenerator()
+    ids = [generator.new_id("testreporter") for _ in range(2000)]
+    assert len(set(ids)) == len(ids)
+    assert ids == sorted(ids)
+    assert all(bribe_id.startswith("teer") and is_well_formed(bribe_id) for bribe_id in ids)
+    mistyped = ids[0][:-1] + ("0" if ids[0][-1] != "0" else "1")
+    assert not is_well_formed(mistyped)
+
+# Test that requests show up in the Prometheus output with their route template and SQL count, for authorized scrapers only
+def test_metrics_endpoint(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "scrape-secret")
+    client.get("/")
+    assert client.get("/metrics").status_code == 403 # the test client is not a local address
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200
+    assert 'http_request_duration_seconds_count{route="/",method="GET",status="200"}' in response.text
+    assert 'http_request_sql_statements_bucket{route="/",le="+Inf"}' in render_metrics()
+
+# Test that the JSON API rejects a track lookup without username or reporting id
+def test_api_track_needs_query():
+    response = client.get("/api/v1/track")
+    assert response.status_code == 400
+    assert response.headers["vary"] == "Accept-Encoding"
+
+# Test that the JSON API pages the filtered listing with its next cursor and gzips large bodies
+def test_api_reports():
+    user_id = uuid.uuid4()
+    with Session(engine) as session:
+        session.add(User(id=user_id, username="apilister"))
+        for i in range(PAGE_SIZE + 5):
+            session.add(Bribe(bribe_id=f"apitest{i:05d}", id=user_id, dept="Police", bribe_amt=1000 + i,
+                              state_ut="Api State", district="Api District", descr="Listed through the API"))
+        session.commit()
+    response = client.get("/api/v1/reports", params={"state": "Api State"}, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    page = response.json()
+    assert page["columns"] == ["ofcl_name", "dept", "state_ut", "district", "bribe_amt", "doi", "bribe_id"]
+    assert len(page["rows"]) == PAGE_SIZE
+    assert page["rows"][0][page["columns"].index("bribe_id")] == f"apitest{PAGE_SIZE + 4:05d}"
+    assert "state=Api+State" in page["next"]
+    last_page = client.get(page["next"], headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in last_page.headers
+    assert [row[-1] for row in last_page.json()["rows"]] == [f"apitest{i:05d}" for i in range(4, -1, -1)]
+    assert last_page.json()["next"] is None
+
+# Test that the JSON API finds the reports of a user and a single report by its reporting id
+def test_api_track():
+    user_id = uuid.uuid4()
+    with Session(engine) as session:
+        session.add(User(id=user_id, username="apitracker"))
+        session.add(Bribe(bribe_id="apitrack0001", id=user_id, dept="Police", bribe_amt=100,
+                          state_ut="Goa", district="North Goa", descr="Tracked through the API"))
+        session.add(Bribe(bribe_id="apitrack0002", id=user_id, dept="Transport", bribe_amt=200,
+                          state_ut="Goa", district="North Goa", descr="Tracked through the API"))
+        session.commit()
+    response = client.get("/api/v1/track", params={"username": "apitracker"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["columns"][:2] == ["bribe_id", "username"]
+    assert sorted(row[0] for row in body["rows"]) == ["apitrack0001", "apitrack0002"]
+    assert all(row[1] == "apitracker" for row in body["rows"])
+    response = client.get("/api/v1/track", params={"reporting_id": "apitrack0001"})
+    assert [row[0] for row in response.json()["rows"]] == ["apitrack0001"]
+
+# Test that exports need a signed-in user and stream the filtered reports as CSV and JSON Lines
+def test_export_reports():
+    assert client.get("/export").status_code == 401
+    user_id = uuid.uuid4()
+    with Session(engine) as session:
+        session.add(User(id=user_id, username="exporter"))
+        session.add(Bribe(bribe_id="exporttest01", id=user_id, ofcl_name="Ravi", dept="Police", bribe_amt=100,
+                          state_ut="Export State", district="North", descr="Asked for cash, twice",
+                          doi=datetime.date(2025, 3, 4)))
+        session.add(Bribe(bribe_id="exporttest02", id=user_id, dept="Transport", bribe_amt=200,
+                          state_ut="Export State", district="South", descr="Licence fee"))
+        session.commit()
+    app.dependency_overrides[get_current_user] = lambda: VerifiedUser({"sub": str(user_id), "user_metadata": {"username": "exporter"}})
+    try:
+        response = client.get("/export", params={"state": "Export State"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        rows = list(csv.reader(io.StringIO(response.text)))
+        assert rows[0] == ["bribe_id", "ofcl_name", "dept", "bribe_amt", "state_ut", "district", "doi", "descr"]
+        assert sorted(rows[1:]) == [
+            ["exporttest01", "Ravi", "Police", "100", "Export State", "North", "2025-03-04", "Asked for cash, twice"],
+            ["exporttest02", "", "Transport", "200", "Export State", "South", "", "Licence fee"],
+        ]
+        response = client.get("/export", params={"format": "jsonl", "state": "Export State", "dept": "Police"})
+        assert [json.loads(line) for line in response.text.splitlines()] == [{
+            "bribe_id": "exporttest01", "ofcl_name": "Ravi", "dept": "Police", "bribe_amt": 100, "state_ut": "Export State",
+            "district": "North", "doi": "2025-03-04", "descr": "Asked for cash, twice",
+        }]
+    finally:
+        app.dependency_overrides.clear()
+
+# Test that a submitted report is committed and counted in the statistics rollup
+def test_report_bribe_updates_rollup():
+    user_id = uuid.uuid4()
+    with Session(engine) as session:
+        session.add(User(id=user_id, username="rollupreporter"))
+        session.commit()
+    app.dependency_overrides[get_current_user] = lambda: VerifiedUser({"sub": str(user_id), "user_metadata": {"username": "rollupreporter"}})
+    try:
+        report_data = {"department": "Rollup Department", "amount": 700, "state": "Rollup State",
+                       "district": "Rollup District", "description": "Bribe for service", "date": "2025-03-04"}
+        assert client.post("/report_bribe", data=report_data).template.name == "bribe_reported.html"
+        assert client.post("/report_bribe", data={**report_data, "amount": 300}).template.name == "bribe_reported.html"
+    finally:
+        app.dependency_overrides.clear()
+    with Session(engine) as session:
+        stat = session.get(BribeStat, ("Rollup State", "Rollup District", "Rollup Department", "2025-03"))
+        assert (stat.report_count, stat.amount_total, stat.amount_max) == (2, 1000, 700)
+
+# A user who renamed themselves in user_metadata must not get their reports tracked under that name
+def test_report_bribe_metadata_username_not_trusted():
+    alice_id, impostor_id = uuid.uuid4(), uuid.uuid4()
+    with Session(engine) as session:
+        session.add(User(id=alice_id, username="alice"))
+        session.add(User(id=impostor_id, username="impostor"))
+        session.commit()
+    app.dependency_overrides[get_current_user] = lambda: VerifiedUser({"sub": str(impostor_id), "user_metadata": {"username": "alice"}})
+    try:
+        report_data = {"department": "Impostor Department", "amount": 900, "state": "Impostor State",
+                       "district": "Impostor District", "description": "Bribe for service", "date": "2025-03-04"}
+        assert client.post("/report_bribe", data=report_data).template.name == "bribe_reported.html"
+    finally:
+        app.dependency_overrides.clear()
+    response = client.get("/api/v1/track", params={"username": "alice"})
+    assert response.status_code == 404
+    response = client.get("/api/v1/track", params={"username": "impostor"})
+    assert response.status_code == 200 and len(response.json()["rows"]) == 1
+
+# Test that signup writes the public user row with the new user's token, not the shared client's key
+def test_signup_inserts_user_with_new_session_token(monkeypatch):
+    sent = []
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(request)
+        return httpx.Response(201, json=[{}])
+    postgrest = AsyncPostgrestClient("http://supabase.test/rest/v1", headers={"Authorization": "Bearer anon-key"})
+    postgrest.session = httpx.AsyncClient(base_url="http://supabase.test/rest/v1", headers=postgrest.session.headers,
+                                          transport=httpx.MockTransport(handler))
+    async def no_existing_user():
+        return SimpleNamespace(data=False)
+    fake_supabase = SimpleNamespace(rpc=lambda *args: SimpleNamespace(execute=no_existing_user), table=postgrest.table)
+    async def sign_up(credentials):
+        return SimpleNamespace(user=SimpleNamespace(id=str(uuid.uuid4())), session=SimpleNamespace(access_token="new-user-token"))
+    monkeypatch.setattr(main, "supabase", fake_supabase, raising=False)
+    monkeypatch.setattr(main, "scoped_auth", lambda supabase: SimpleNamespace(sign_up=sign_up))
+
+    response = client.post("/signup", json={"username": "newsignup", "password": "secret123"})
+    assert response.status_code == 200
+    assert len(sent) == 1 and sent[0].url.path == "/rest/v1/user"
+    assert sent[0].headers["Authorization"] == "Bearer new-user-token"
+    assert postgrest.session.headers["Authorization"] == "Bearer anon-key" # shared session untouched
+
+# Test that search answers 503 instead of failing on a database without the descr_tsv column
+def test_search_unavailable_without_descr_tsv():
+    if engine.dialect.name == "postgresql":
+        pytest.skip("descr_tsv can be created on Postgres, see test_search_reports")
+    response = client.get("/search", params={"q": "police"})
+    assert response.status_code == 503
+
+# Test that search finds reports by description and ranks official name matches first (Postgres only)
+@pytest.mark.skipif(engine.dialect.name != "postgresql", reason="full-text search needs Postgres")
+def test_search_reports():
+    with engine.begin() as connection:
+        # same generated column as migration 9c4f2e7a1b36, create_all doesn't add it
+        connection.exec_driver_sql("""
+            ALTER TABLE bribe ADD COLUMN IF NOT EXISTS descr_tsv tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('english'::regconfig, coalesce(ofcl_name, '') || ' ' || coalesce(dept, '')), 'A') ||
+                setweight(to_tsvector('english'::regconfig, coalesce(descr, '')), 'B')
+            ) STORED
+        """)
+    user_id = uuid.uuid4()
+    with Session(engine) as session:
+        session.add(User(id=user_id, username="searcher"))
+        session.add(Bribe(bribe_id="searchtest01", id=user_id, ofcl_name="Ravi", dept="Transport", bribe_amt=100,
+                          state_ut="Goa", district="North Goa", descr="Asked for money to renew a licence"))
+        session.add(Bribe(bribe_id="searchtest02", id=user_id, ofcl_name="Licence clerk", dept="Transport", bribe_amt=200,
+                          state_ut="Goa", district="North Goa", descr="Asked for money to renew a licence"))
+        session.add(Bribe(bribe_id="searchtest03", id=user_id, ofcl_name="Anil", dept="Police", bribe_amt=300,
+                          state_ut="Goa", district="North Goa", descr="Traffic fine waived for cash"))
+        session.commit()
+    response = client.get("/search", params={"q": "licences"})
+    assert response.status_code == 200
+    reports = response.json()["reports"]
+    assert [report["bribe_id"] for report in reports] == ["searchtest02", "searchtest01"]
+    assert "<b>licence</b>" in reports[0]["snippet"]
+
+# Test that only a duplicate bribe_id counts as a clash worth retrying, not other integrity errors
+def test_is_duplicate_key():
+    user_id = uuid.uuid4()
+    with Session(engine) as session:
+        session.add(User(id=user_id, username="clasher"))
+        session.add(Bribe(bribe_id="clashtest001", id=user_id, dept="Police", bribe_amt=100,
+                          state_ut="Goa", district="North Goa", descr="First"))
+        session.commit()
+    with Session(engine) as session:
+        session.add(Bribe(bribe_id="clashtest001", id=user_id, dept="Police", bribe_amt=200,
+                          state_ut="Goa", district="North Goa", descr="Second"))
+        with pytest.raises(IntegrityError) as duplicate:
+            session.commit()
+    assert is_duplicate_key(duplicate.value, "bribe")
+    with Session(engine) as session:
+        session.add(Bribe(bribe_id="clashtest002", id=user_id, bribe_amt=300,
+                          state_ut="Goa", district="North Goa", descr="No department"))
+        with pytest.raises(IntegrityError) as not_null:
+            session.commit()
+    assert not is_duplicate_key(not_null.value, "bribe")
+
+# Test that evidence is screened from the received upload sizes before anything is stored
+def test_accepted_evidence():
+    def upload(filename, content_type, data):
+        return UploadFile(io.BytesIO(data), size=len(data), filename=filename, headers=Headers({"content-type": content_type}))
+    photo = upload("photo.png", "image/png", b"x" * 100)
+    files = [photo, upload("notes.txt", "text/plain", b"x" * 100), upload("empty.pdf", "application/pdf", b"")]
+    assert accepted_evidence(files, "evidencetest", max_bytes=100) == [(photo, "images")]
+    with pytest.raises(EvidenceTooLarge):
+        accepted_evidence(files + [upload("scan.pdf", "application/pdf", b"x" * 101)], "evidencetest", max_bytes=100)
+
 # Test for the report route (GET '/report')
 def test_report_route():
     # Make a GET request to the report route
@@ -0,0 +1,113 @@
+from typing import Awaitable, Callable
+from sqlmodel import select
+from .db import async_session
+from .models import User
+import asyncio
+import hashlib
+import math
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+USERNAME_INDEX_ENABLED = os.environ.get("username_index_enabled", "true").lower() in ("1", "true", "yes")
+USERNAME_INDEX_REBUILD_SECONDS = float(os.environ.get("username_index_rebuild_seconds", "300"))
+USERNAME_INDEX_ERROR_RATE = float(os.environ.get("username_index_error_rate", "0.01"))
+USERNAME_INDEX_MIN_CAPACITY = 100_000
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = USERNAME_INDEX_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    # double hashing: position i is h1 + i*h2, both halves of one blake2b digest
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+# Local answer to "is this username taken?" for /check_username. A miss in the filter means the name
+# was not in the user table at the last rebuild and has not been signed up through this worker since,
+# so it is reported available without a round trip. Possible hits, and every check before the first
+# build, fall back to the remote check. Signups on other workers become visible at the next rebuild.
+class UsernameIndex:
+    def __init__(self, rebuild_seconds: float = USERNAME_INDEX_REBUILD_SECONDS):
+        self.rebuild_seconds = rebuild_seconds
+        self._filter: BloomFilter | None = None
+        self._task: asyncio.Task | None = None
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._added_during_rebuild: list[str] | None = None
+
+    async def rebuild(self) -> None:
+        # Signups while the table is read or the filter is built may be missing from the new filter,
+        # they are recorded by add() and replayed into it before the swap
+        self._added_during_rebuild = []
+        try:
+            async with async_session() as session:
+                result = await session.stream_scalars(select(User.username).execution_options(yield_per=10_000))
+                usernames = []
+                async for partition in result.partitions():
+                    usernames.extend(name.lower() for name in partition)
+            bloom = BloomFilter(max(USERNAME_INDEX_MIN_CAPACITY, len(usernames) * 2))
+            for i, name in enumerate(usernames):
+                bloom.add(name)
+                if i % 10_000 == 9_999:
+                    await asyncio.sleep(0) # don't hold the event loop for the whole build
+            for name in self._added_during_rebuild:
+                bloom.add(name)
+            self._filter = bloom
+        finally:
+            self._added_during_rebuild = None
+        logger.info("Username index rebuilt with %s usernames", len(usernames))
+
+    def add(self, username: str) -> None:
+        username = username.lower()
+        if self._filter is not None:
+            self._filter.add(username)
+        if self._added_during_rebuild is not None:
+            self._added_during_rebuild.append(username)
+
+    def might_exist(self, username: str) -> bool:
+        return self._filter is None or username.lower() in self._filter
+
+    # Returns whether the username exists. remote_check is only awaited for possible hits, and
+    # concurrent checks of the same name share one remote call.
+    async def exists(self, username: str, remote_check: Callable[[], Awaitable[bool]]) -> bool:
+        username = username.lower()
+        if not self.might_exist(username):
+            return False
+        future = self._inflight.get(username)
+        if future is None:
+            future = asyncio.ensure_future(remote_check())
+            self._inflight[username] = future
+            future.add_done_callback(lambda _: self._inflight.pop(username, None))
+        # shielded so one client going away doesn't cancel the call for the others
+        return await asyncio.shield(future)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._rebuild_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _rebuild_forever(self) -> None:
+        while True:
+            try:
+                await self.rebuild()
+            except Exception as e:
+                logger.error("Username index rebuild failed: %s", e, exc_info=True)
+            await asyncio.sleep(self.rebuild_seconds)
+
+username_index = UsernameIndex()
@@ -0,0 +1,54 @@
+from collections import OrderedDict
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .models import User
+import os
+import time
+import uuid
+
+USER_CACHE_SIZE = int(os.environ.get("user_cache_size", "10000"))
+# Unknown usernames are remembered briefly so repeated lookups of a typo don't all reach the database,
+# short enough that a signup handled by another worker becomes visible quickly
+USER_CACHE_NEGATIVE_TTL = float(os.environ.get("user_cache_negative_ttl", "30"))
+
+# username -> user id, shared by report_bribe and track_bribe. Usernames never change once created,
+# so positive entries only leave the cache through LRU eviction or a signup invalidating the name.
+class UserDirectory:
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, negative_ttl: float = USER_CACHE_NEGATIVE_TTL):
+        self.maxsize = maxsize
+        self.negative_ttl = negative_ttl
+        self._ids: OrderedDict[str, uuid.UUID] = OrderedDict()
+        self._missing: dict[str, float] = {} # username -> expiry
+
+    async def resolve(self, session: AsyncSession, username: str) -> uuid.UUID | None:
+        user_id = self._ids.get(username)
+        if user_id is not None:
+            self._ids.move_to_end(username)
+            return user_id
+        expires_at = self._missing.get(username)
+        if expires_at is not None:
+            if expires_at > time.monotonic():
+                return None
+            del self._missing[username]
+
+        user_id = (await session.exec(select(User.id).where(User.username == username))).first()
+        if user_id is None:
+            if len(self._missing) >= self.maxsize:
+                self._missing.clear()
+            self._missing[username] = time.monotonic() + self.negative_ttl
+        else:
+            self.remember(username, user_id)
+        return user_id
+
+    def remember(self, username: str, user_id: uuid.UUID | str) -> None:
+        self._missing.pop(username, None)
+        self._ids[username] = user_id if isinstance(user_id, uuid.UUID) else uuid.UUID(str(user_id))
+        self._ids.move_to_end(username)
+        while len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+    def invalidate(self, username: str) -> None:
+        self._ids.pop(username, None)
+        self._missing.pop(username, None)
+
+user_directory = UserDirectory()